@@ -1,18 +1,30 @@
 """The NAD Cl multi-room audio controller integration."""
 
+import asyncio
 import logging
 
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import CONF_IP_ADDRESS, Platform, CONF_PORT
+from homeassistant.const import CONF_IP_ADDRESS, Platform, CONF_PORT, CONF_NAME
 from homeassistant.core import HomeAssistant
 from homeassistant.exceptions import ConfigEntryNotReady
-
-from .config_flow import DOMAIN
-from .nad_client import NadClient, DEFAULT_TCP_PORT
-
-CONF_CLIENT = "client"
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+
+from .config_flow import (
+    DOMAIN, CONF_BRIDGED, CONF_MODEL, CONF_SERIAL_NUMBER, CONF_SW_VERSION, CONF_UNUSED, async_get_discovery_manager
+)
+from .coordinator import NadCoordinator, polled_channels
+from .manager import async_get_manager
+from .nad_client import AsyncNadClient, DEFAULT_TCP_PORT
+from .services import async_setup_services, async_unload_services
+from .snapshot import SnapshotStore
+from .topology import TopologyStore
+
+CONF_COORDINATOR = "coordinator"
+CONF_AMP = "amp"
+CONF_CHANNELS = "channels"
+IDENTITY_KEYS = (CONF_NAME, CONF_SERIAL_NUMBER, CONF_MODEL, CONF_SW_VERSION)
 UNDO_UPDATE_LISTENER = "undo_update_listener"
-PLATFORMS = [Platform.MEDIA_PLAYER]
+PLATFORMS = [Platform.MEDIA_PLAYER, Platform.SENSOR]
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -24,23 +36,58 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     ip = entry.data.get(CONF_IP_ADDRESS)
     port = entry.data.get(CONF_PORT, DEFAULT_TCP_PORT)
 
+    manager = async_get_manager(hass)
+    # Right after the config flow, the connection it probed with is still open
+    client = async_get_discovery_manager(hass).async_take_client(ip, port)
+    if client is None:
+        client = AsyncNadClient(ip, port, session=async_get_clientsession(hass), limiter=manager.limiter)
+        try:
+            await client.connect()
+        except (OSError, asyncio.TimeoutError) as ex:
+            raise ConfigEntryNotReady from ex
+
+    channels = polled_channels(entry.options.get(CONF_BRIDGED, []), entry.options.get(CONF_UNUSED, []))
+    coordinator = NadCoordinator(hass, client, channels)
     try:
-        client = NadClient(ip, port)
-    except Exception as ex:
-        raise ConfigEntryNotReady from ex
+        await _async_identify(hass, entry, client)
+        await coordinator.async_config_entry_first_refresh()
+    except ConfigEntryNotReady:
+        await client.close()
+        raise
 
+    # Only listen for updates now, so storing the identity does not reload the entry
     undo_listener = entry.add_update_listener(update_listener)
 
     hass.data[DOMAIN][entry.entry_id] = {
-        CONF_CLIENT: client,
+        CONF_COORDINATOR: coordinator,
         UNDO_UPDATE_LISTENER: undo_listener,
     }
 
+    manager.async_add(entry.entry_id, coordinator)
+
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+    async_setup_services(hass)
 
     return True
 
 
+async def _async_identify(hass: HomeAssistant, entry: ConfigEntry, client: AsyncNadClient):
+    """Store the device identity in the entry, so later setups need no round trips for it."""
+    if all(entry.data.get(key) for key in IDENTITY_KEYS):
+        return
+
+    batch = client.batch()
+    batch.get_device_name()
+    batch.get_serial_number()
+    batch.get_device_model()
+    batch.get_firmware_version()
+    identity = await batch.execute()
+    if None in identity:
+        raise ConfigEntryNotReady(f"Could not identify the NAD controller at {client.ip}")
+
+    hass.config_entries.async_update_entry(entry, data={**entry.data, **dict(zip(IDENTITY_KEYS, identity))})
+
+
 async def async_unload_entry(hass: HomeAssistant, config_entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     unload_ok = await hass.config_entries.async_unload_platforms(
@@ -50,7 +97,11 @@ async def async_unload_entry(hass: HomeAssistant, config_entry: ConfigEntry) ->
     hass.data[DOMAIN][config_entry.entry_id][UNDO_UPDATE_LISTENER]()
 
     if unload_ok:
-        hass.data[DOMAIN].pop(config_entry.entry_id)
+        data = hass.data[DOMAIN].pop(config_entry.entry_id)
+        async_get_manager(hass).async_remove(config_entry.entry_id)
+        await data[CONF_COORDINATOR].client.close()
+        if not hass.data[DOMAIN]:
+            async_unload_services(hass)
 
     return unload_ok
 
@@ -58,3 +109,9 @@ async def async_unload_entry(hass: HomeAssistant, config_entry: ConfigEntry) ->
 async def update_listener(hass: HomeAssistant, config_entry: ConfigEntry) -> None:
     """Handle options update."""
     await hass.config_entries.async_reload(config_entry.entry_id)
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Remove what was stored for a deleted config entry."""
+    await TopologyStore(hass, entry.entry_id).async_remove()
+    await SnapshotStore(hass, entry.entry_id).async_remove()
@@ -9,8 +9,8 @@ import voluptuous as vol
 import homeassistant.helpers.config_validation as cv
 from homeassistant import core, exceptions
 from homeassistant.components import ssdp
-from homeassistant.config_entries import ConfigFlow
-from homeassistant.const import CONF_IP_ADDRESS, CONF_PORT
+from homeassistant.config_entries import ConfigEntry, ConfigFlow, OptionsFlow
+from homeassistant.const import CONF_IP_ADDRESS, CONF_NAME, CONF_PORT
 from homeassistant.data_entry_flow import FlowResult, AbortFlow
 from homeassistant.helpers.service_info.ssdp import (
     ATTR_UPNP_MODEL_NAME,
@@ -18,7 +18,8 @@ from homeassistant.helpers.service_info.ssdp import (
     ATTR_UPNP_FRIENDLY_NAME
 )
 
-from .nad_client import NadClient, DEFAULT_TCP_PORT
+from .discovery import NadDiscoveryManager
+from .nad_client import DEFAULT_TCP_PORT
 
 DOMAIN = "nad_controller"
 
@@ -39,16 +40,41 @@ _LOGGER = logging.getLogger(__name__)
 
 CONF_SERIAL_NUMBER = "serial_number"
 CONF_MODEL = "model"
+CONF_SW_VERSION = "sw_version"
+# Bridged pairs by their first output, and outputs without speakers
+CONF_BRIDGED = "bridged"
+CONF_UNUSED = "unused"
 
+# Outputs are bridged in pairs of an odd output and the one after it
+BRIDGE_PAIRS = {str(output): f"Outputs {output} & {output + 1}" for output in range(1, 17, 2)}
+OUTPUTS = {str(output): f"Output {output}" for output in range(1, 17)}
 
-async def async_step_init(
-        self, user_input: dict[str, Any] | None = None
-) -> FlowResult:
-    """Manage the options."""
-    if user_input is not None:
-        return self.async_create_entry(title="", data=user_input)
 
-    return self.async_show_form(step_id="init", data_schema=DATA_SCHEMA)
+@core.callback
+def async_get_discovery_manager(hass: core.HomeAssistant) -> NadDiscoveryManager:
+    if DATA_NAD_DISCOVERY_MANAGER not in hass.data:
+        hass.data[DATA_NAD_DISCOVERY_MANAGER] = NadDiscoveryManager(hass)
+    return hass.data[DATA_NAD_DISCOVERY_MANAGER]
+
+
+class NadOptionsFlow(OptionsFlow):
+    """Which outputs are bridged and which are not used, the amp can not be asked for this."""
+
+    def __init__(self, config_entry: ConfigEntry):
+        self._config_entry = config_entry
+
+    async def async_step_init(
+            self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Manage the options."""
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        options = self._config_entry.options
+        return self.async_show_form(step_id="init", data_schema=vol.Schema({
+            vol.Optional(CONF_BRIDGED, default=options.get(CONF_BRIDGED, [])): cv.multi_select(BRIDGE_PAIRS),
+            vol.Optional(CONF_UNUSED, default=options.get(CONF_UNUSED, [])): cv.multi_select(OUTPUTS),
+        }))
 
 
 class NetworkFlow(ConfigFlow, domain=DOMAIN):
@@ -56,8 +82,12 @@ class NetworkFlow(ConfigFlow, domain=DOMAIN):
 
     VERSION = 1
 
+    @staticmethod
+    @core.callback
+    def async_get_options_flow(config_entry: ConfigEntry) -> NadOptionsFlow:
+        return NadOptionsFlow(config_entry)
+
     def __init__(self):
-        self.client = None
         self.serial_number = None
         self.udn = None
         self.ip = None
@@ -96,40 +126,36 @@ class NetworkFlow(ConfigFlow, domain=DOMAIN):
 
     async def async_step_connect(self) -> FlowResult:
         """Connect to the controller."""
-        try:
-            if self.client is None:
-                self.client = NadClient(self.ip, self.port)
-        except Exception as e:
-            _LOGGER.exception(e)
+        identity = await async_get_discovery_manager(self.hass).async_probe(self.ip, self.port, self.udn)
+        if identity is None:
             return self.async_abort(reason="cannot_connect")
 
-        if not self.serial_number:
-            self.serial_number = self.client.get_serial_number()
-        if not self.model_name:
-            self.model_name = self.client.get_device_model()
-
-        if self.serial_number is not None:
-            unique_id = self.construct_unique_id(self.model_name, self.serial_number)
-            await self.async_set_unique_id(unique_id)
-            self._abort_if_unique_id_configured()
-        else:
-            _LOGGER.error(
-                "Could not get serial number of ip %s, "
-                "unique_id's will not be available",
-                self.ip,
-            )
-            self._async_abort_entries_match({CONF_IP_ADDRESS: self.ip, CONF_PORT: self.port})
+        self.serial_number = identity.serial_number
+        self.model_name = identity.model
+        await self.async_set_unique_id(self.construct_unique_id(self.model_name, self.serial_number))
+        self._abort_and_release_if_configured()
 
+        # The identity is stored, so the setup does not have to ask for it again
         return self.async_create_entry(
-            title=self.client.get_device_name(),
+            title=identity.name,
             data={
                 CONF_IP_ADDRESS: self.ip,
                 CONF_PORT: self.port,
-                CONF_MODEL: self.model_name,
-                CONF_SERIAL_NUMBER: self.serial_number,
+                CONF_NAME: identity.name,
+                CONF_MODEL: identity.model,
+                CONF_SERIAL_NUMBER: identity.serial_number,
+                CONF_SW_VERSION: identity.sw_version,
             },
         )
 
+    def _abort_and_release_if_configured(self, updates: dict[str, Any] | None = None):
+        """Abort when the amp is set up already, closing the connection the probe kept for its setup."""
+        try:
+            self._abort_if_unique_id_configured(updates)
+        except AbortFlow:
+            async_get_discovery_manager(self.hass).async_release_client(self.ip, self.port)
+            raise
+
     async def async_step_ssdp(self, discovery_info: ssdp.SsdpServiceInfo) -> FlowResult:
         """Handle a discovered NAD controller.
         This flow is triggered by the SSDP component. It will check if the
@@ -147,16 +173,18 @@ class NetworkFlow(ConfigFlow, domain=DOMAIN):
         self.ip = str(urlparse(discovery_info.ssdp_location).hostname)
         self.port = DEFAULT_TCP_PORT
 
-        try:
-            if self.client is None:
-                self.client = NadClient(self.ip, self.port)
-            self.model_name = self.client.get_device_model()
-            self.serial_number = self.client.get_serial_number()
-        except (Exception):
+        # An amp that is set up already is not probed, that would open a second connection to it
+        self._async_abort_entries_match({CONF_IP_ADDRESS: self.ip})
+
+        # Repeated announcements of the same UDN are answered from the identity cache
+        identity = await async_get_discovery_manager(self.hass).async_probe(self.ip, self.port, self.udn)
+        if identity is None:
             return self.async_abort(reason="cannot_connect")
+        self.model_name = identity.model
+        self.serial_number = identity.serial_number
 
         await self.async_set_unique_id(self.construct_unique_id(self.model_name, self.serial_number))
-        self._abort_if_unique_id_configured({CONF_IP_ADDRESS: self.ip})
+        self._abort_and_release_if_configured({CONF_IP_ADDRESS: self.ip})
 
         self.context.update(
             {
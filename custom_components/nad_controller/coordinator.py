@@ -0,0 +1,231 @@
+"""Polls a NAD multi-room audio controller once for all of its entities."""
+import asyncio
+import logging
+import time
+
+import aiohttp
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+
+from .nad_client import AsyncNadClient
+from .protocol import EVENT_CONNECTION, EVENT_OUTPUT_GAIN, EVENT_OUTPUT_MUTE, EVENT_POWER, NadEvent
+from .state import NadState
+from .topology import Topology
+
+_LOGGER = logging.getLogger(__name__)
+
+# State changes are pushed by the amp, polling only checks for missed events. Right after activity
+# polls are MIN_POLL_INTERVAL seconds apart, every poll that finds nothing new doubles that up to
+# MAX_POLL_INTERVAL. While the amp is off only its power status is polled.
+MIN_POLL_INTERVAL = 10
+MAX_POLL_INTERVAL = 600
+POWER_OFF_INTERVAL = 300
+OUTPUT_CHANNELS = range(1, 17)
+
+
+def polled_channels(bridged: list[str], unused: list[str]) -> list[int]:
+    """The outputs that get polled, the second output of a bridged pair follows the first."""
+    skipped = {int(output) for output in unused} | {int(output) + 1 for output in bridged}
+    return [channel for channel in OUTPUT_CHANNELS if channel not in skipped]
+
+
+def _in_out_channels(in_outs: dict) -> list[tuple]:
+    """What the in-out page says about every output channel, as it is in the payload."""
+    return list(zip(in_outs["output-gain"], in_outs["sources"], in_outs["dsp-presets"]))
+
+
+class NadCoordinator(DataUpdateCoordinator[NadState]):
+    """Fetches the state of all channels in one go.
+
+    Gains, sources and presets come from one read of the in-out page of the web interface,
+    of which only the channels that changed since the last read are parsed. Power and mutes
+    are not on that page, they are read in one batch over TCP. When the web interface does
+    not answer, the gains are read over TCP as well. So is the first refresh, which should not
+    hold up setting up the entry on the web interface: the stored topology of the entities
+    covers the sources and presets until the next poll.
+
+    Polling is scheduled by the manager, from `next_poll` which every poll moves ahead. Polls
+    skip the state cache of the client, they are there to find what the amp did not report.
+
+    The channel entities are views on `data`. With every update, `changed_channels` tells which
+    channels changed, so the others can skip it. It is None when all entities have to check.
+    """
+
+    def __init__(self, hass: HomeAssistant, client: AsyncNadClient, channels: list[int] = OUTPUT_CHANNELS):
+        super().__init__(hass, _LOGGER, name=f"NAD {client.ip}", update_interval=None)
+        self.client = client
+        self.channels = channels
+        self.poll_interval = MIN_POLL_INTERVAL
+        self.next_poll = time.monotonic() + MIN_POLL_INTERVAL
+        self._in_out_channels: list[tuple] = []
+        self.topology: Topology | None = None
+        self.changed_channels: set[int] | None = None
+        self._listeners_success = True
+        client.add_listener(self._handle_event)
+
+    @callback
+    def async_set_topology(self, topology: Topology):
+        """Use the sources and presets of the topology, and its values for what was not read yet."""
+        self.topology = topology
+        if self.data is None:
+            return
+        for channel in self.channels:
+            output = topology.outputs[channel - 1]
+            if self.data.gain(channel) is None:
+                self.data.set_gain(channel, output.gain)
+            if self.data.source(channel) is None:
+                self.data.set_source(channel, topology.inputs.index(output.source))
+            if self.data.preset(channel) is None:
+                self.data.set_preset(channel, topology.presets.index(output.dsp_preset))
+
+    @callback
+    def async_update_listeners(self) -> None:
+        if self.last_update_success != self._listeners_success:
+            # Every entity became (un)available
+            self._listeners_success = self.last_update_success
+            self.changed_channels = None
+        super().async_update_listeners()
+        self.changed_channels = None
+
+    @callback
+    def async_update_channel(self, channel: int):
+        """Let the entity of one channel know its values in `data` changed."""
+        self.changed_channels = {channel}
+        self.async_update_listeners()
+
+    @callback
+    def async_note_activity(self):
+        """Poll quickly again, something is happening on the amp."""
+        self.poll_interval = MIN_POLL_INTERVAL
+        self.next_poll = min(self.next_poll, time.monotonic() + MIN_POLL_INTERVAL)
+        # Written values may not have made it to the amp, so check every channel on the next poll
+        self._in_out_channels = []
+
+    def _schedule_next_poll(self, state: NadState, changed: bool):
+        if not state.power:
+            self.poll_interval = POWER_OFF_INTERVAL
+        elif changed:
+            self.poll_interval = MIN_POLL_INTERVAL
+        else:
+            self.poll_interval = min(MAX_POLL_INTERVAL, self.poll_interval * 2)
+        self.next_poll = time.monotonic() + self.poll_interval
+
+    @callback
+    def _handle_event(self, event: NadEvent):
+        if self.data is None:
+            return
+
+        if event.kind == EVENT_CONNECTION:
+            if event.value:
+                # Anything could have changed while the amp was unreachable
+                self.hass.async_create_task(self.async_request_refresh())
+            else:
+                self.async_set_update_error(ConnectionError(f"Lost connection to {self.client.ip}"))
+            return
+
+        if event.value is None:
+            # The amp only told which channel changed, so fetch the new value
+            self.hass.async_create_task(self._async_fetch_channel(event))
+            return
+
+        if event.kind == EVENT_POWER and event.value == self.data.power:
+            # Like the heartbeat of the client, which reads the power status of an idle amp
+            return
+
+        self.async_note_activity()
+        if event.kind == EVENT_POWER:
+            self.data.power = event.value
+            self.async_update_listeners()
+            return
+
+        if event.kind == EVENT_OUTPUT_GAIN:
+            self.data.set_gain(event.channel, event.value)
+            self.client.output_gain_writer.confirm(event.channel, event.value)
+        elif event.kind == EVENT_OUTPUT_MUTE:
+            self.data.set_muted(event.channel, event.value)
+        self.async_update_channel(event.channel)
+
+    async def _async_fetch_channel(self, event: NadEvent):
+        if event.kind == EVENT_OUTPUT_GAIN:
+            value = await self.client.get_output_gain(event.channel)
+        else:
+            value = await self.client.get_output_mute(event.channel)
+
+        if value is not None:
+            self._handle_event(NadEvent(event.kind, event.channel, value))
+
+    @staticmethod
+    def _is_on(power_status: str) -> bool:
+        return power_status.split(':')[1] == "On"
+
+    async def _async_update_data(self) -> NadState:
+        previous = self.data or NadState()
+        if self.data is not None and not previous.power:
+            # The channels do not answer while the amp is off, so only check whether it was turned on
+            power = await self.client.get_power_status()
+            if power is None:
+                raise UpdateFailed(f"No reply from NAD server at {self.client.ip}")
+            if not self._is_on(power):
+                self._schedule_next_poll(previous, False)
+                self.changed_channels = set()
+                return previous
+
+        batch = self.client.batch()
+        batch.get_power_status()
+        for channel in self.channels:
+            batch.get_output_mute(channel)
+        if self.data is not None:
+            (power, *mutes), in_outs = await asyncio.gather(batch.execute(use_cache=False), self._async_read_in_out())
+        else:
+            (power, *mutes), in_outs = await batch.execute(use_cache=False), None
+        if power is None:
+            raise UpdateFailed(f"No reply from NAD server at {self.client.ip}")
+
+        # Keep the last known values of channels that did not answer this time
+        state = previous.copy()
+        state.power = self._is_on(power)
+        for channel, muted in zip(self.channels, mutes):
+            if muted is not None:
+                state.set_muted(channel, muted)
+
+        if in_outs is not None:
+            self._apply_in_out(state, in_outs)
+        else:
+            await self._async_update_gains(state)
+
+        changed = state.changed_channels(previous)
+        self._schedule_next_poll(state, state.power != previous.power or bool(changed))
+        self.changed_channels = set(changed) if self.data is not None and state.power == previous.power else None
+        return state
+
+    async def _async_read_in_out(self) -> dict | None:
+        try:
+            return await self.client.read_in_out()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as ex:
+            _LOGGER.debug(f"Could not read the in-out page of {self.client.ip}, reading gains over TCP: {ex}")
+            return None
+
+    def _apply_in_out(self, state: NadState, in_outs: dict):
+        channels = _in_out_channels(in_outs)
+        for channel, values in zip(OUTPUT_CHANNELS, channels):
+            index = channel - 1
+            if channel not in self.channels or (
+                    index < len(self._in_out_channels) and self._in_out_channels[index] == values):
+                continue
+
+            gain, source, preset = values
+            state.set_gain(channel, float(gain))
+            state.set_source(channel, int(source))
+            state.set_preset(channel, int(preset))
+            self.client.output_gain_writer.confirm(channel, state.gain(channel))
+            self.client.cache.set((EVENT_OUTPUT_GAIN, channel), state.gain(channel))
+        self._in_out_channels = channels
+
+    async def _async_update_gains(self, state: NadState):
+        batch = self.client.batch()
+        for channel in self.channels:
+            batch.get_output_gain(channel)
+        for channel, gain in zip(self.channels, await batch.execute(use_cache=False)):
+            if gain is not None:
+                state.set_gain(channel, gain)
+                self.client.output_gain_writer.confirm(channel, gain)
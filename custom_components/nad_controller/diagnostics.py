@@ -0,0 +1,28 @@
+"""Diagnostics support for the NAD multi-room audio controller."""
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_IP_ADDRESS
+from homeassistant.core import HomeAssistant
+
+from . import CONF_COORDINATOR
+from .config_flow import DOMAIN, CONF_SERIAL_NUMBER
+from .manager import async_get_manager
+
+TO_REDACT = {CONF_IP_ADDRESS, CONF_SERIAL_NUMBER}
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict:
+    coordinator = hass.data[DOMAIN][entry.entry_id][CONF_COORDINATOR]
+    client = coordinator.client
+    return {
+        "entry": async_redact_data(entry.data, TO_REDACT),
+        "connected": client.connected,
+        "rtt": client.rtt,
+        "reply_interval": client.reply_interval,
+        "pipeline_window": client.pipeline_window,
+        "state": coordinator.data.as_dict() if coordinator.data is not None else None,
+        "metrics": client.metrics.as_dict(),
+        "commands": client.stats.total().as_dict(),
+        "opcodes": client.stats.as_dict(),
+        "manager": async_get_manager(hass).metrics,
+    }
@@ -0,0 +1,113 @@
+"""Probing of NAD controllers for the config flow, without blocking the event loop."""
+import asyncio
+import logging
+from dataclasses import dataclass
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.event import async_call_later
+
+from .nad_client import AsyncNadClient
+
+_LOGGER = logging.getLogger(__name__)
+
+PROBE_TIMEOUT = 5
+# How long a probed connection is kept open for the config entry that gets set up next
+HANDOFF_TIMEOUT = 300
+
+
+@dataclass
+class NadIdentity:
+    name: str
+    serial_number: str
+    model: str
+    sw_version: str
+
+
+class NadDiscoveryManager:
+    """Probes amps, remembering the identity of every UDN and keeping the connection for the setup.
+
+    Concurrent probes of the same address share one connection attempt.
+    """
+
+    def __init__(self, hass: HomeAssistant):
+        self._hass = hass
+        self._identities: dict[str, NadIdentity] = {}
+        self._probes: dict[tuple[str, int], asyncio.Task] = {}
+        self._clients: dict[tuple[str, int], tuple[AsyncNadClient, CALLBACK_TYPE]] = {}
+
+    async def async_probe(self, ip: str, port: int, udn: str | None = None) -> NadIdentity | None:
+        """Identify the amp at this address, None when it did not answer within PROBE_TIMEOUT."""
+        if udn is not None and udn in self._identities:
+            return self._identities[udn]
+
+        address = (ip, port)
+        task = self._probes.get(address)
+        if task is None:
+            task = self._hass.async_create_task(self._async_probe(address))
+            self._probes[address] = task
+            task.add_done_callback(lambda _: self._probes.pop(address, None))
+
+        # A flow that goes away must not cancel the probe for the others
+        identity = await asyncio.shield(task)
+        if identity is not None and udn is not None:
+            self._identities[udn] = identity
+        return identity
+
+    async def _async_probe(self, address: tuple[str, int]) -> NadIdentity | None:
+        from .manager import async_get_manager
+
+        ip, port = address
+        client = AsyncNadClient(ip, port, timeout=PROBE_TIMEOUT, session=async_get_clientsession(self._hass),
+                                limiter=async_get_manager(self._hass).limiter)
+        try:
+            await asyncio.wait_for(client.connect(), PROBE_TIMEOUT)
+            batch = client.batch()
+            batch.get_device_name()
+            batch.get_serial_number()
+            batch.get_device_model()
+            batch.get_firmware_version()
+            identity = await asyncio.wait_for(batch.execute(), PROBE_TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as ex:
+            _LOGGER.debug(f"Could not probe NAD controller at {ip}:{port}: {ex}")
+            await client.close()
+            return None
+
+        if None in identity:
+            _LOGGER.debug(f"NAD controller at {ip}:{port} did not identify itself: {identity}")
+            await client.close()
+            return None
+
+        self._keep_client(address, client)
+        return NadIdentity(*identity)
+
+    def _keep_client(self, address: tuple[str, int], client: AsyncNadClient):
+        self._drop_client(address)
+
+        async def _async_expire(_):
+            if self._clients.get(address, (None,))[0] is client:
+                del self._clients[address]
+                await client.close()
+
+        self._clients[address] = (client, async_call_later(self._hass, HANDOFF_TIMEOUT, _async_expire))
+
+    def _drop_client(self, address: tuple[str, int]):
+        if address in self._clients:
+            client, cancel_expiry = self._clients.pop(address)
+            cancel_expiry()
+            self._hass.async_create_task(client.close())
+
+    def async_release_client(self, ip: str, port: int):
+        """Close the connection of an earlier probe, when no setup is going to take it."""
+        self._drop_client((ip, port))
+
+    def async_take_client(self, ip: str, port: int) -> AsyncNadClient | None:
+        """The connection of an earlier probe, if it is still open."""
+        client, cancel_expiry = self._clients.pop((ip, port), (None, None))
+        if client is None:
+            return None
+        cancel_expiry()
+        if not client.connected:
+            self._hass.async_create_task(client.close())
+            return None
+        return client
@@ -0,0 +1,32 @@
+"""Base entity of the NAD multi-room audio controller integration."""
+from homeassistant.core import callback
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+from .coordinator import NadCoordinator
+
+
+class NadEntity(CoordinatorEntity[NadCoordinator]):
+    """Only writes its state when something it shows changed, not with every coordinator update.
+
+    Entities read their state from the coordinator when it is written, so what they showed last
+    is kept to compare with.
+    """
+    _written_state: tuple | None = None
+
+    def _state_key(self) -> tuple:
+        """Everything the state and attributes of the entity are made of."""
+        return (self.available,)
+
+    @callback
+    def async_write_ha_state(self) -> None:
+        self._written_state = self._state_key()
+        super().async_write_ha_state()
+
+    @callback
+    def _async_write_state_if_changed(self):
+        if self._state_key() != self._written_state:
+            self.async_write_ha_state()
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        self._async_write_state_if_changed()
@@ -0,0 +1,77 @@
+"""Shares scheduling and the command budget over all NAD amps of a Home Assistant instance."""
+import logging
+import time
+from datetime import datetime, timedelta
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_track_time_interval
+
+from .config_flow import DOMAIN
+from .coordinator import NadCoordinator
+from .nad_client import InFlightLimiter
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_MANAGER = f"{DOMAIN}_manager"
+MAX_IN_FLIGHT = 32
+# At most one amp is polled per tick, so polls that fall due together get spread out
+POLL_TICK = timedelta(seconds=2)
+
+
+class NadManager:
+    """Polls the amps when their coordinators say they are due, one amp per tick.
+
+    All clients share one limiter, so together they never have more than MAX_IN_FLIGHT
+    commands awaiting a reply.
+    """
+
+    def __init__(self, hass: HomeAssistant):
+        self._hass = hass
+        self.limiter = InFlightLimiter(MAX_IN_FLIGHT)
+        self._coordinators: dict[str, NadCoordinator] = {}
+        self._unsub_poll: CALLBACK_TYPE | None = None
+
+    @property
+    def coordinators(self) -> list[NadCoordinator]:
+        return list(self._coordinators.values())
+
+    @callback
+    def async_add(self, entry_id: str, coordinator: NadCoordinator):
+        self._coordinators[entry_id] = coordinator
+        if self._unsub_poll is None:
+            self._unsub_poll = async_track_time_interval(self._hass, self._async_poll_due, POLL_TICK)
+
+    @callback
+    def async_remove(self, entry_id: str):
+        self._coordinators.pop(entry_id, None)
+        if not self._coordinators and self._unsub_poll is not None:
+            self._unsub_poll()
+            self._unsub_poll = None
+
+    async def _async_poll_due(self, now: datetime):
+        if not self._coordinators:
+            return
+
+        coordinator = min(self._coordinators.values(), key=lambda c: c.next_poll)
+        if coordinator.next_poll > time.monotonic():
+            return
+
+        # Also when the poll fails, the coordinator moves this ahead when it succeeds
+        coordinator.next_poll = time.monotonic() + coordinator.poll_interval
+        await coordinator.async_refresh()
+
+    @property
+    def metrics(self) -> dict[str, int]:
+        """The metrics of all clients added up."""
+        metrics = {"amps": len(self._coordinators), "in_flight": self.limiter.in_flight}
+        for coordinator in self._coordinators.values():
+            for name, value in coordinator.client.metrics.as_dict().items():
+                metrics[name] = metrics.get(name, 0) + value
+        return metrics
+
+
+@callback
+def async_get_manager(hass: HomeAssistant) -> NadManager:
+    if DATA_MANAGER not in hass.data:
+        hass.data[DATA_MANAGER] = NadManager(hass)
+    return hass.data[DATA_MANAGER]
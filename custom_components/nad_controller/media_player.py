@@ -1,8 +1,9 @@
 """Support for interfacing with NAD multi-room audio controller."""
+import asyncio
 import logging
-from dataclasses import dataclass
 from enum import Enum
 
+import aiohttp
 from homeassistant import exceptions
 from homeassistant.components.media_player import (
     MediaPlayerEntity,
@@ -10,40 +11,24 @@ from homeassistant.components.media_player import (
     MediaPlayerDeviceClass, MediaPlayerState
 )
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import STATE_UNAVAILABLE
-from homeassistant.core import HomeAssistant
+from homeassistant.const import STATE_UNAVAILABLE, CONF_NAME, Platform
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.exceptions import PlatformNotReady
+from homeassistant.helpers import entity_registry as er
 from homeassistant.helpers.entity import DeviceInfo
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 
-from . import CONF_CLIENT
-from .config_flow import DOMAIN
-from .nad_client import NadClient
+from . import CONF_AMP, CONF_CHANNELS, CONF_COORDINATOR
+from .config_flow import DOMAIN, CONF_BRIDGED, CONF_MODEL, CONF_SERIAL_NUMBER, CONF_SW_VERSION, CONF_UNUSED
+from .coordinator import NadCoordinator, OUTPUT_CHANNELS
+from .entity import NadEntity
+from .nad_client import NadBatch
+from .snapshot import ChannelSnapshot, SnapshotStore
+from .topology import InputChannel, Preset, TopologyStore, parse_in_out
 
 _LOGGER = logging.getLogger(__name__)
 
 
-@dataclass
-class InputChannel:
-    name: str
-    gain: float
-    value: int
-
-
-@dataclass
-class Preset:
-    name: str
-    value: int
-
-
-@dataclass
-class OutputChannel:
-    name: str
-    gain: float
-    value: int
-    source: InputChannel
-    dsp_preset: Preset
-
-
 async def async_setup_entry(
         hass: HomeAssistant,
         config_entry: ConfigEntry,
@@ -51,36 +36,98 @@ async def async_setup_entry(
 ) -> None:
     """Set up the NAD Cl multi-room audio controller entry."""
     data = hass.data[DOMAIN][config_entry.entry_id]
-    client: NadClient = data[CONF_CLIENT]
+    coordinator: NadCoordinator = data[CONF_COORDINATOR]
+    client = coordinator.client
+
+    # Build the entities from the last known topology, so startup does not wait for the web interface
+    store = TopologyStore(hass, config_entry.entry_id)
+    in_outs = await store.async_load()
+    stored = in_outs is not None
+    if not stored:
+        try:
+            in_outs = await client.read_in_out()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as ex:
+            raise PlatformNotReady(f"Could not read the in-out configuration of {client.ip}") from ex
+        await store.async_save(in_outs)
+
+    topology = parse_in_out(in_outs)
+    coordinator.async_set_topology(topology)
+
+    amp = NadAmp(
+        coordinator,
+        config_entry.data[CONF_NAME],
+        config_entry.data[CONF_SERIAL_NUMBER],
+        config_entry.data[CONF_MODEL],
+        config_entry.data[CONF_SW_VERSION]
+    )
 
-    in_outs = await hass.async_add_executor_job(client.read_in_out)
+    # The second output of a bridged pair is driven through the first, unused outputs are disabled
+    followers = {int(output) + 1 for output in config_entry.options.get(CONF_BRIDGED, [])}
+    unused = {int(output) for output in config_entry.options.get(CONF_UNUSED, [])}
+    registry = er.async_get(hass)
 
-    inputs = [InputChannel(
-        in_outs['input-names'][i]['name'],
-        float(in_outs['input-gain'][i]),
-        int(in_outs['input-names'][i]['value'])
-    ) for i in range(len(in_outs['input-names']))]
+    entities = [amp]
+    for output_channel_index in OUTPUT_CHANNELS:
+        unique_id = f"{amp.unique_id}_{output_channel_index}"
+        entity_id = registry.async_get_entity_id(Platform.MEDIA_PLAYER, DOMAIN, unique_id)
+        if output_channel_index in followers:
+            if entity_id is not None:
+                registry.async_remove(entity_id)
+            continue
+
+        enabled = output_channel_index not in unused
+        if entity_id is not None:
+            _async_sync_disabled(registry, entity_id, enabled)
+        output = topology.outputs[output_channel_index - 1]
+        _LOGGER.info(f"Adding channel {output}")
+        entities.append(NadChannel(coordinator, amp, output_channel_index, output.name, enabled))
+
+    channels = [channel for channel in entities[1:] if channel.output_channel in coordinator.channels]
+    snapshots = await SnapshotStore(hass, config_entry.entry_id).async_load()
+    for channel in channels:
+        channel.snapshot = snapshots.get(channel.output_channel)
+
+    data[CONF_AMP] = amp
+    data[CONF_CHANNELS] = channels
+    async_add_entities(entities)
 
-    presets = [Preset(dsp_item['name'], int(dsp_item['value'])) for dsp_item in in_outs['dsp-preset-items']]
+    if stored:
+        config_entry.async_create_background_task(
+            hass,
+            _async_refresh_topology(coordinator, store, in_outs, entities[1:]),
+            f"{DOMAIN} topology refresh {client.ip}"
+        )
 
-    outputs = [OutputChannel(
-        in_outs['output-names'][i]['name'],
-        float(in_outs['output-gain'][i]),
-        int(in_outs['output-names'][i]['value']),
-        inputs[in_outs['sources'][i]],
-        presets[in_outs['dsp-presets'][i]]
-    ) for i in range(len(in_outs['output-names']))]
 
-    amp = NadAmp(client)
+@callback
+def _async_sync_disabled(registry: er.EntityRegistry, entity_id: str, enabled: bool):
+    """Disable the entity of an unused output, and enable it again when the output is used again."""
+    disabled_by = registry.async_get(entity_id).disabled_by
+    if not enabled and disabled_by is None:
+        registry.async_update_entity(entity_id, disabled_by=er.RegistryEntryDisabler.INTEGRATION)
+    elif enabled and disabled_by is er.RegistryEntryDisabler.INTEGRATION:
+        registry.async_update_entity(entity_id, disabled_by=None)
 
-    entities = [amp]
-    for output_channel_index in range(1, 17):
-        _LOGGER.info(f"Adding channel {outputs[output_channel_index - 1]}")
-        entities.append(
-            NadChannel(hass, client, amp, output_channel_index, outputs[output_channel_index - 1], inputs, presets)
-        )
 
-    async_add_entities(entities)
+async def _async_refresh_topology(coordinator: NadCoordinator, store: TopologyStore, stored: dict,
+                                  channels: list["NadChannel"]):
+    """Read the topology from the amp and apply what changed since it was stored."""
+    client = coordinator.client
+    try:
+        in_outs = await client.read_in_out()
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as ex:
+        _LOGGER.warning(f"Could not refresh the in-out configuration of {client.ip}: {ex}")
+        return
+
+    if in_outs == stored:
+        return
+
+    await store.async_save(in_outs)
+    topology = parse_in_out(in_outs)
+    coordinator.async_set_topology(topology)
+    for channel in channels:
+        channel.async_set_name(topology.outputs[channel.output_channel - 1].name)
+    coordinator.async_update_listeners()
 
 
 class GlobalSource(Enum):
@@ -88,29 +135,26 @@ class GlobalSource(Enum):
     Global2 = 2
 
 
-class NadAmp(MediaPlayerEntity):
+class NadAmp(NadEntity, MediaPlayerEntity):
     _attr_supported_features = (
             MediaPlayerEntityFeature.TURN_ON
             | MediaPlayerEntityFeature.TURN_OFF
             | MediaPlayerEntityFeature.SELECT_SOURCE
     )
 
-    def __init__(self, client: NadClient):
-        self._client = client
+    def __init__(self, coordinator: NadCoordinator, device_name: str, serial_number: str, model: str,
+                 sw_version: str):
+        super().__init__(coordinator)
+        self._client = coordinator.client
 
         self._attr_device_class = MediaPlayerDeviceClass.RECEIVER
 
-        device_name = client.get_device_name()
-        serial_number = client.get_serial_number()
-        model = client.get_device_model()
-        sw_version = client.get_firmware_version()
-
         self._attr_source_list = [source.name for source in GlobalSource.__members__.values()]
         self._attr_source_list.append("None")
         self._source = None
 
         self._attr_device_info = DeviceInfo(
-            configuration_url=f"http://{client.ip}",
+            configuration_url=f"http://{self._client.ip}",
             identifiers={(DOMAIN, serial_number)},
             manufacturer="NAD",
             model=model,
@@ -121,45 +165,30 @@ class NadAmp(MediaPlayerEntity):
         self._attr_unique_id = f"{DOMAIN}_{serial_number}"
         self._attr_name = device_name
 
-        self._state = None
-        self._state_listeners = []
-
-    def add_state_listener(self, listener):
-        self._state_listeners.append(listener)
-
-    def update_state_listeners(self):
-        _LOGGER.info(f"Updating all listeners to {self._attr_state}")
-        for listener in self._state_listeners:
-            listener.async_schedule_update_ha_state()
+    @property
+    def state(self) -> MediaPlayerState:
+        return MediaPlayerState.ON if self.coordinator.data.power else MediaPlayerState.OFF
 
-    async def async_update(self):
-        """Retrieve latest state."""
-        response = self._client.get_power_status()
-        if not response:
-            if self._attr_state != MediaPlayerState.OFF:
-                self._attr_state = MediaPlayerState.OFF
-                self.update_state_listeners()
-            return
+    def _state_key(self) -> tuple:
+        return self.available, self.state, self._source
 
-        new_state = MediaPlayerState.ON if response.split(':')[1] == "On" else MediaPlayerState.OFF
-        if new_state != self._attr_state:
-            self._attr_state = new_state
-            self.update_state_listeners()
+    def _set_power(self, power: bool):
+        # The channels follow the power state of the amp, so update all coordinator listeners
+        self.coordinator.data.power = power
+        self.coordinator.async_note_activity()
+        self.coordinator.async_update_listeners()
 
     async def async_turn_on(self):
-        self._client.power_on()
-        self._attr_state = MediaPlayerState.ON
+        await self._client.power_on()
+        self._set_power(True)
 
     async def async_turn_off(self):
-        self._client.power_off()
-        self._attr_state = MediaPlayerState.OFF
+        await self._client.power_off()
+        self._set_power(False)
 
     async def async_toggle(self):
         await self._client.power_toggle()
-        self._attr_state = {
-            MediaPlayerState.ON: MediaPlayerState.OFF,
-            MediaPlayerState.OFF: MediaPlayerState.ON
-        }[self._attr_state]
+        self._set_power(not self.coordinator.data.power)
 
     @property
     def source(self):
@@ -174,17 +203,20 @@ class NadAmp(MediaPlayerEntity):
 
         if self._source == new_source:
             return
+        self.coordinator.async_note_activity()
 
         if self._source is not None:
-            self._client.set_global_control(self._source.value, False)
+            await self._client.set_global_control(self._source.value, False)
 
         self._source = new_source
 
         if self._source is not None:
-            self._client.set_global_control(self._source.value, True)
+            await self._client.set_global_control(self._source.value, True)
+        self._async_write_state_if_changed()
 
 
-class NadChannel(MediaPlayerEntity):
+class NadChannel(NadEntity, MediaPlayerEntity):
+    """A view on one output in the state table of the coordinator, shared by all channels of the amp."""
     _attr_supported_features = (
             MediaPlayerEntityFeature.VOLUME_MUTE
             | MediaPlayerEntityFeature.VOLUME_SET
@@ -193,96 +225,176 @@ class NadChannel(MediaPlayerEntity):
             | MediaPlayerEntityFeature.SELECT_SOUND_MODE
     )
 
-    def __init__(self, hass: HomeAssistant, client: NadClient, amp: NadAmp, output_index: int, channel: OutputChannel,
-                 inputs: list[InputChannel], dsp_presets: list[Preset]):
-        self.hass = hass
-        self._client = client
+    def __init__(self, coordinator: NadCoordinator, amp: NadAmp, output_index: int, name: str, enabled=True):
+        super().__init__(coordinator)
+        self._attr_entity_registry_enabled_default = enabled
+        self._client = coordinator.client
         self._output_channel = output_index
 
-        self._dsp_presets = dsp_presets
-        self._attr_sound_mode_list = [preset.name for preset in dsp_presets]
-        self._sound_mode = channel.dsp_preset
-
         self._attr_device_class = MediaPlayerDeviceClass.SPEAKER
 
-        self._sources = inputs
-        self._attr_source_list = [source.name for source in inputs]
-        self._source = channel.source
-
         self._attr_unique_id = f"{amp.unique_id}_{self._output_channel}"
-        self._attr_name = channel.name
+        self._attr_name = name
         self._attr_device_info = amp.device_info
-        self._amp = amp
-        self._amp.add_state_listener(self)
 
         self._snapshot = None
-        self._volume = channel.gain
 
-    async def async_update(self):
-        """Retrieve latest state."""
-        if self._amp.state == MediaPlayerState.ON:
-            self._attr_state = MediaPlayerState.ON
-        else:
-            self._attr_state = STATE_UNAVAILABLE
+    def _state_key(self) -> tuple:
+        data = self.coordinator.data
+        channel = self._output_channel
+        return (self.available, data.power, data.gain(channel), data.muted(channel), data.source(channel),
+                data.preset(channel), self._attr_name, self.coordinator.topology)
 
-        response = self._client.get_output_gain(self._output_channel)
-        if response is None:
-            return
-        self._volume = response
-
-        response = self._client.get_output_mute(self._output_channel)
-        if response is None:
-            return
-        self._attr_is_volume_muted = response
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        changed = self.coordinator.changed_channels
+        if changed is None or self._output_channel in changed:
+            super()._handle_coordinator_update()
 
+    @property
     def available(self) -> bool:
-        return self._amp.state == MediaPlayerState.ON
+        return super().available and self.coordinator.data.power
+
+    @property
+    def state(self):
+        return MediaPlayerState.ON if self.coordinator.data.power else STATE_UNAVAILABLE
+
+    @property
+    def output_channel(self) -> int:
+        return self._output_channel
+
+    def find_source(self, name: str) -> InputChannel:
+        topology = self.coordinator.topology
+        if name not in topology.source_index:
+            raise InvalidSource(f"The source should be one of {topology.source_list}")
+        return topology.inputs[topology.source_index[name]]
+
+    def find_sound_mode(self, name: str) -> Preset:
+        topology = self.coordinator.topology
+        if name not in topology.sound_mode_index:
+            raise InvalidSoundMode(f"The sound mode should be one of {topology.sound_mode_list}")
+        return topology.presets[topology.sound_mode_index[name]]
+
+    def take_snapshot(self) -> ChannelSnapshot:
+        self._snapshot = ChannelSnapshot(self._gain, self.is_volume_muted, self.source, self.sound_mode)
+        return self._snapshot
+
+    @property
+    def snapshot(self) -> ChannelSnapshot | None:
+        return self._snapshot
+
+    @snapshot.setter
+    def snapshot(self, snapshot: ChannelSnapshot | None):
+        self._snapshot = snapshot
+
+    def add_restore_commands(self, batch: NadBatch) -> dict:
+        """Add the commands that bring this channel back to its snapshot, returns what they change."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {}
+
+        topology = self.coordinator.topology
+        changes = {}
+        if snapshot.gain is not None and snapshot.gain != self._gain:
+            batch.set_output_gain(self._output_channel, snapshot.gain)
+            changes["gain"] = snapshot.gain
+        if snapshot.muted is not None and snapshot.muted != self.is_volume_muted:
+            batch.set_output_mute(self._output_channel, snapshot.muted)
+            changes["muted"] = snapshot.muted
+        # Sources or presets that were renamed since the snapshot are left alone
+        if snapshot.source != self.source and snapshot.source in topology.source_index:
+            changes["source"] = self.find_source(snapshot.source)
+            batch.set_output_source(self._output_channel, changes["source"].value + 1)
+        if snapshot.preset != self.sound_mode and snapshot.preset in topology.sound_mode_index:
+            changes["sound_mode"] = self.find_sound_mode(snapshot.preset)
+            batch.set_output_preset(self._output_channel, changes["sound_mode"].value)
+        return changes
+
+    @callback
+    def async_apply(self, gain: float | None = None, muted: bool | None = None, source: InputChannel | None = None,
+                    sound_mode: Preset | None = None):
+        """Take over values that were written to the amp for this channel."""
+        self.coordinator.async_note_activity()
+        data = self.coordinator.data
+        topology = self.coordinator.topology
+        if gain is not None:
+            data.set_gain(self._output_channel, gain)
+        if muted is not None:
+            data.set_muted(self._output_channel, muted)
+        if source is not None:
+            data.set_source(self._output_channel, topology.source_index[source.name])
+        if sound_mode is not None:
+            data.set_preset(self._output_channel, topology.sound_mode_index[sound_mode.name])
+        self._async_write_state_if_changed()
+
+    @callback
+    def async_set_name(self, name: str):
+        """Take over the name of the output, it is written with the next coordinator update."""
+        self._attr_name = name
+
+    @property
+    def _gain(self) -> float | None:
+        return self.coordinator.data.gain(self._output_channel)
+
+    async def _async_set_gain(self, gain: float):
+        gain = min(6.0, max(-6.0, gain))
+        self.async_apply(gain=gain)
+        await self._client.output_gain_writer.write(self._output_channel, gain)
 
     @property
     def volume_level(self):
         """Volume level of the media player (0..1)."""
-        if self._volume is None:
+        gain = self._gain
+        if gain is None:
             return None
-        return (float(self._volume) + 6) / 12
+        return (gain + 6) / 12
 
     async def async_set_volume_level(self, volume: float) -> None:
-        self._volume = volume * 12 - 6
-        self._client.set_output_gain(self._output_channel, self._volume)
+        await self._async_set_gain(volume * 12 - 6)
 
     async def async_volume_up(self):
-        self._client.set_output_gain(self._output_channel, self._volume + 0.5)
-        self._volume += 0.5
+        await self._async_set_gain(self._gain + 0.5)
 
     async def async_volume_down(self):
-        self._client.set_output_gain(self._output_channel, self._volume - 0.5)
-        self._volume -= 0.5
+        await self._async_set_gain(self._gain - 0.5)
+
+    @property
+    def is_volume_muted(self) -> bool | None:
+        return self.coordinator.data.muted(self._output_channel)
 
     async def async_mute_volume(self, mute: bool) -> None:
-        self._client.set_output_mute(self._output_channel, mute)
-        self._attr_is_volume_muted = mute
+        await self._client.set_output_mute(self._output_channel, mute)
+        self.async_apply(muted=mute)
+
+    @property
+    def source_list(self) -> list[str]:
+        return self.coordinator.topology.source_list
 
     @property
     def source(self):
-        return self._source.name
+        source = self.coordinator.data.source(self._output_channel)
+        source_list = self.coordinator.topology.source_list
+        return source_list[source] if source is not None and source < len(source_list) else None
 
     async def async_select_source(self, source):
-        if source not in self._attr_source_list:
-            raise InvalidSource(f"The global source should be one of {self._attr_source_list}")
-
-        self._source = [s for s in self._sources if s.name == source][0]
-        self._client.set_output_source(self._output_channel, self._source.value + 1)
+        new_source = self.find_source(source)
+        await self._client.set_output_source(self._output_channel, new_source.value + 1)
+        self.async_apply(source=new_source)
 
     async def async_select_sound_mode(self, sound_mode):
-        if sound_mode not in self._attr_sound_mode_list:
-            raise InvalidSoundMode(f"The sound mode should be one of {self._attr_sound_mode_list}")
+        new_sound_mode = self.find_sound_mode(sound_mode)
+        await self._client.set_output_preset(self._output_channel, new_sound_mode.value)
+        self.async_apply(sound_mode=new_sound_mode)
 
-        self._sound_mode = [p for p in self._dsp_presets][0]
-
-        self._client.set_output_preset(self._output_channel, self._sound_mode.value + 1)
+    @property
+    def sound_mode_list(self) -> list[str]:
+        return self.coordinator.topology.sound_mode_list
 
     @property
     def sound_mode(self):
-        return self._sound_mode.name
+        preset = self.coordinator.data.preset(self._output_channel)
+        sound_mode_list = self.coordinator.topology.sound_mode_list
+        return sound_mode_list[preset] if preset is not None and preset < len(sound_mode_list) else None
 
 
 class InvalidSource(exceptions.IntegrationError):
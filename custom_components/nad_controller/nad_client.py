@@ -1,232 +1,919 @@
+import asyncio
+import heapq
+import itertools
 import logging
+import math
+import random
 import socket
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field, fields
+from functools import partial
 from enum import Enum
-
-import requests
+from typing import Any, Awaitable, Callable
+
+import aiohttp
+
+from .protocol import (
+    BRIDGE_ACKS, CHANNELS, EVENT_CONNECTION, EVENT_OUTPUT_GAIN, EVENT_OUTPUT_MUTE, GET_OUTPUT_GAIN_FRAMES,
+    GET_OUTPUT_MUTE_FRAMES, INPUT_GAIN_ACKS, OP_BRIDGE, OP_DELAY_TIME, OP_DEVICE_MODEL, OP_DEVICE_NAME, OP_DHCP,
+    OP_FIRMWARE_VERSION, OP_FLASH_LED, OP_GET_OUTPUT_GAIN, OP_GET_OUTPUT_MUTE, OP_GLOBAL_CONTROL, OP_GREEN_MODE,
+    OP_INSTALLATION_DATE, OP_IP_ADDRESS,
+    OP_POWER_METHOD, OP_POWER_OFF, OP_POWER_ON, OP_POWER_STATUS, OP_POWER_TOGGLE, OP_PROJECT_NAME, OP_RESET,
+    OP_SERIAL_NUMBER, OP_STEREO_MONO, OP_SUBNET_MASK, OUTPUT_GAIN_ACKS, OUTPUT_GAIN_REPLIES, OUTPUT_MUTE_ACKS,
+    OUTPUT_MUTE_REPLIES, OUTPUT_PRESET_ACKS, OUTPUT_SOURCE_ACKS, POWER_OFF_ACK, POWER_ON_ACK, POWER_STATUS, PRESETS,
+    SET_INPUT_GAIN_FRAMES, SET_OUTPUT_GAIN_FRAMES, SET_OUTPUT_MUTE_FRAMES, SET_OUTPUT_PRESET_FRAMES,
+    SET_OUTPUT_SOURCE_FRAMES, STEREO_MONO_ACKS, NadEvent, NadFramer, ReplyCorrelator, encode, parse_event,
+)
+from .stats import CommandStats
 
 _LOGGER = logging.getLogger(__name__)
 
 DEFAULT_TCP_PORT = 52000
 BUFFER_SIZE = 1024
+DEFAULT_TIMEOUT = 5
+QUEUE_TIMEOUT = 10
+MAX_QUEUED_COMMANDS = 64
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+# An idle connection is checked with a power status probe every HEARTBEAT_INTERVAL seconds, and
+# at once when a command got no reply. It is considered dead when the probe takes longer than four
+# round trips (within these bounds). TCP keepalive already finds half-open sockets, the probe finds
+# an amp that stopped answering.
+HEARTBEAT_INTERVAL = 15
+HEARTBEAT_MIN_TIMEOUT = 2
+RTT_SMOOTHING = 0.2
+# TCP keepalive, for when the amp disappears without closing the connection
+KEEPALIVE_IDLE = 10
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+# Polling reads written to the amp but not answered yet, more wait for their replies. The window
+# covers one round trip of the amp answering back to back: the round trip divided by the time
+# between those replies. Until both are measured, it is PIPELINE_WINDOW.
+PIPELINE_WINDOW = 4
+MAX_PIPELINE_WINDOW = 64
+MIN_REPLY_INTERVAL = 0.0001
+PRIORITY_USER = 0
+PRIORITY_BACKGROUND = 1
+# Reads of the kind that polling sends, they give way to everything else
+BACKGROUND_OPCODES = frozenset((OP_GET_OUTPUT_GAIN, OP_GET_OUTPUT_MUTE, OP_POWER_STATUS))
+DEFAULT_CACHE_TTL = 30
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=10, connect=5)
+
+DEVICE_NAME_FRAME = encode(OP_DEVICE_NAME)
+DEVICE_MODEL_FRAME = encode(OP_DEVICE_MODEL)
+PROJECT_NAME_FRAME = encode(OP_PROJECT_NAME)
+INSTALLATION_DATE_FRAME = encode(OP_INSTALLATION_DATE)
+FIRMWARE_VERSION_FRAME = encode(OP_FIRMWARE_VERSION)
+SERIAL_NUMBER_FRAME = encode(OP_SERIAL_NUMBER)
+RESET_FRAME = encode(OP_RESET)
+POWER_ON_FRAME = encode(OP_POWER_ON)
+POWER_OFF_FRAME = encode(OP_POWER_OFF)
+POWER_TOGGLE_FRAME = encode(OP_POWER_TOGGLE)
+POWER_STATUS_FRAME = encode(OP_POWER_STATUS)
 
 
 class StereoMono(Enum):
-    STEREO = "00"
-    MONO = "01"
+    STEREO = 0x00
+    MONO = 0x01
 
 
 class Bridge(Enum):
-    STAND = "00"
-    BRIDGE = "01"
+    STAND = 0x00
+    BRIDGE = 0x01
 
 
 class PowerMethod(Enum):
-    POWER_BUTTON = "00"
-    ALWAYS_ON = "01"
-    V12_TRIGGER = "02"
-    SIGNAL_SENSE = "03"
+    POWER_BUTTON = 0x00
+    ALWAYS_ON = 0x01
+    V12_TRIGGER = 0x02
+    SIGNAL_SENSE = 0x03
+
+
+@dataclass
+class NadCommand:
+    frame: bytes
+    reply: bytes | None = None
+    parse: Callable[[memoryview], Any] | None = None
+    # Reads are served from the state cache under this key
+    cache_key: tuple | None = None
+    # Acknowledged writes store this (key, value) in the state cache
+    writes: tuple | None = None
+
+
+_MISSING = object()
+
+
+@dataclass
+class ClientMetrics:
+    commands_sent: int = 0
+    replies_missed: int = 0
+    commands_dropped: int = 0
+    reconnects: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return {field.name: getattr(self, field.name) for field in fields(self)}
+
+
+class InFlightLimiter:
+    """Bounds the number of commands awaiting a reply, over all clients that share it."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._waiters: list[asyncio.Future] = []
+
+    async def acquire(self, count: int):
+        while self.in_flight + count > self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += count
+
+    def release(self, count: int):
+        self.in_flight -= count
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+@dataclass(order=True)
+class _QueuedCommand:
+    priority: int
+    sequence: int
+    command: NadCommand = field(compare=False)
+    # Everybody waiting for the reply, reads of the same value share one queued command
+    waiters: list[asyncio.Future] = field(compare=False, default_factory=list)
+    expiry: asyncio.TimerHandle | None = field(compare=False, default=None)
+    done: bool = field(compare=False, default=False)
 
+    @property
+    def abandoned(self) -> bool:
+        return all(waiter.done() for waiter in self.waiters)
+
+    def resolve(self, reply: memoryview | None):
+        self.done = True
+        if self.expiry is not None:
+            self.expiry.cancel()
+        for waiter in self.waiters:
+            if not waiter.done():
+                waiter.set_result(reply)
+
+
+class StateCache:
+    """Last known device values keyed by (command family, channel), valid for `ttl` seconds."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: dict[tuple, tuple[Any, float]] = {}
+
+    def get(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return _MISSING
+        return entry[0]
+
+    def set(self, key: tuple, value):
+        self._entries[key] = (value, time.monotonic())
+
+    def invalidate(self, key: tuple | None = None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+
+class WriteCoalescer:
+    """Keeps only the latest value per key while a write for that key is in flight.
+
+    Values that equal the last confirmed one are not sent at all, so dragging a slider
+    only sends the values the amp can keep up with. Values are compared after `quantize`,
+    which maps them onto what the amp can actually be set to.
+    """
+
+    def __init__(self, write: Callable[[Any, Any], Awaitable[Any]], quantize: Callable[[Any], Any] = lambda v: v):
+        self._write = write
+        self._quantize = quantize
+        self._targets = {}
+        self._confirmed = {}
+        self._writing = set()
+
+    def confirm(self, key, value):
+        """Record a value the amp reported, so that writing it again is skipped."""
+        self._confirmed[key] = value
+
+    async def write(self, key, value):
+        self._targets[key] = value
+        if key in self._writing:
+            # The running write picks up the latest target when it is done
+            return
+
+        self._writing.add(key)
+        try:
+            while key in self._targets:
+                target = self._quantize(self._targets.pop(key))
+                if key in self._confirmed and self._confirmed[key] == target:
+                    continue
+                if await self._write(key, target) is not None:
+                    self._confirmed[key] = target
+        finally:
+            self._writing.discard(key)
 
-class NadClient:
 
-    def __init__(self, ip: str, port=DEFAULT_TCP_PORT):
-        self._ip = ip
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.connect((ip, port))
+class NadCommands(ABC):
+    """Command table shared by the asyncio client and its batches."""
 
-    def send(self, hex_string):
-        try:
-            self._socket.send(bytearray.fromhex(hex_string))
-        except BrokenPipeError as e:
-            _LOGGER.warning(f"Could not reach NAD server at {self.ip}: {str(e)}")
-            return None
+    _ip: str
 
-        response = self._socket.recv(BUFFER_SIZE)
-        _LOGGER.debug(response)
-        return response
+    @abstractmethod
+    def _command(self, frame: bytes, reply=None, parse=None, cache_key=None, writes=None):
+        """Send a command frame, `reply` is the prefix of the frame that answers it.
+
+        `parse` gets the part of the reply after that prefix, without a parser the reply is decoded to a string.
+        """
 
     @staticmethod
-    def to_string(byte_text: bytes):
-        return byte_text.decode().split("\x00")[0] if byte_text is not None else None
+    def _parse_response(response: memoryview | None, reply: bytes | None, parse):
+        if response is None:
+            return None
+        if parse is None:
+            return response.tobytes().decode(errors="replace")
+        return parse(response[len(reply):])
 
     @staticmethod
-    def ip_to_hex(ip: str):
-        return '{:02X}{:02X}{:02X}{:02X}'.format(*map(int, ip.split('.')))
+    def parse_gain(value: memoryview):
+        return float(value)
 
     @staticmethod
-    def int_to_hex(i: int):
-        return '{:02X}'.format(i)
+    def parse_mute(value: memoryview):
+        return value == b"Mute"
+
+    @staticmethod
+    def ip_to_bytes(ip: str):
+        return tuple(map(int, ip.split('.')))
 
     @property
     def ip(self):
         return self._ip
 
-    def global_input_to_hex(self, global_input: int):
+    @staticmethod
+    def global_input_index(global_input: int):
         if not 1 <= global_input <= 2:
             raise ValueError(f"Channel should be either 1 or 2, but was {global_input}")
-        return self.int_to_hex(global_input - 1)
+        return global_input - 1
 
-    def channel_to_hex(self, channel: int):
-        if not 1 <= channel <= 16:
+    @staticmethod
+    def channel_index(channel: int):
+        if not 1 <= channel <= CHANNELS:
             raise ValueError("Channel should be between 1 and 16 (inclusive)")
-        return self.int_to_hex(channel - 1)
+        return channel - 1
 
-    def gain_to_hex(self, gain: float):
+    @staticmethod
+    def gain_step(gain: float):
         if not -6 <= gain <= 6:
             raise ValueError("Gain should be between -6 and 6 (inclusive)")
-        return self.int_to_hex(int((gain + 6) * 2))
+        return int((gain + 6) * 2)
 
-    def preset_to_hex(self, preset_index: int):
-        if not 0 <= preset_index <= 9:
+    @staticmethod
+    def quantize_gain(gain: float):
+        """The gain the amp ends up with, it works in steps of 0.5 dB."""
+        return int((gain + 6) * 2) / 2 - 6
+
+    @staticmethod
+    def preset_index(preset_index: int):
+        if not 0 <= preset_index < PRESETS:
             raise ValueError("Preset index should be between 0 and 9 (inclusive)")
-        return self.int_to_hex(preset_index)
+        return preset_index
 
-    def delay_time_to_hex(self, delay_time: int):
+    @staticmethod
+    def delay_step(delay_time: int):
         if not 0 <= delay_time <= 20:
             raise ValueError("Delay time should be between 0 and 20 (inclusive)")
-        return self.int_to_hex(int(delay_time / 2))
+        return int(delay_time / 2)
 
     # Identification
     def get_device_name(self):
-        return self.to_string(self.send("FF5501E0"))
+        return self._command(DEVICE_NAME_FRAME)
 
     def get_device_model(self):
-        return self.to_string(self.send("FF5501E1"))
+        return self._command(DEVICE_MODEL_FRAME)
 
     def get_project_name(self):
-        return self.to_string(self.send("FF5501E2"))
+        return self._command(PROJECT_NAME_FRAME)
 
     def get_installation_date(self):
-        return self.to_string(self.send("FF5501E4"))
+        return self._command(INSTALLATION_DATE_FRAME)
 
     def get_firmware_version(self):
-        return self.to_string(self.send("FF5501E5"))
+        return self._command(FIRMWARE_VERSION_FRAME)
 
     def get_serial_number(self):
-        return self.to_string(self.send("FF5501E6"))
+        return self._command(SERIAL_NUMBER_FRAME)
 
     def led_flash_on(self):
         # Flash LED:ON
-        return self.to_string(self.send("FF5502EB01"))
+        return self._command(encode(OP_FLASH_LED, 1), b"Flash LED:")
 
     def led_flash_off(self):
         # Flash LED:OFF
-        return self.to_string(self.send("FF5502EB00"))
+        return self._command(encode(OP_FLASH_LED, 0), b"Flash LED:")
 
     def dhcp_on(self):
         # IP Method:DHCP
-        return self.to_string(self.send("FF5502EC01"))
+        return self._command(encode(OP_DHCP, 1), b"IP Method:")
 
     def dhcp_off(self):
         # IP Method:STATIC
-        return self.to_string(self.send("FF5502EC00"))
+        return self._command(encode(OP_DHCP, 0), b"IP Method:")
 
     def set_ip_address(self, ip: str):
         # Broken?
-        return self.to_string(self.send("FF5501ED" + self.ip_to_hex(ip)))
+        return self._command(encode(OP_IP_ADDRESS, *self.ip_to_bytes(ip)))
 
     def set_subnet_mask(self, subnet_mask: str):
         # Broken?
-        return self.to_string(self.send("FF5501EE" + self.ip_to_hex(subnet_mask)))
+        return self._command(encode(OP_SUBNET_MASK, *self.ip_to_bytes(subnet_mask)))
 
     # Control
     def set_global_control(self, global_input: int, on: bool):
         # Set Global 1 ON
         # Set Global 1 OFF
-        global_input_hex = self.global_input_to_hex(global_input)
-        code = {True: "01", False: "00"}[on]
-        return self.to_string(self.send("FF5503F0" + global_input_hex + code))
+        index = self.global_input_index(global_input)
+        return self._command(encode(OP_GLOBAL_CONTROL, index, int(on)), b"Set Global %d" % global_input)
 
     def set_input_gain(self, input_channel: int, gain: float):
         # Cmd:ChannelInputGain ,Channel Input 1
-        channel_hex = self.channel_to_hex(input_channel)
-        gain_hex = self.gain_to_hex(gain)
-        return self.to_string(self.send("FF5503F1" + channel_hex + gain_hex))
+        index = self.channel_index(input_channel)
+        return self._command(SET_INPUT_GAIN_FRAMES[index][self.gain_step(gain)], INPUT_GAIN_ACKS[index])
 
     def set_output_gain(self, output_channel: int, gain: float):
         # Cmd:ChannelOutputGain ,Channel Output 1
-        channel_hex = self.channel_to_hex(output_channel)
-        gain_hex = self.gain_to_hex(gain)
-        return self.to_string(self.send("FF5503F2" + channel_hex + gain_hex))
+        index = self.channel_index(output_channel)
+        return self._command(SET_OUTPUT_GAIN_FRAMES[index][self.gain_step(gain)], OUTPUT_GAIN_ACKS[index],
+                             writes=((EVENT_OUTPUT_GAIN, output_channel), self.quantize_gain(gain)))
 
     def get_output_gain(self, output_channel: int):
         # Channel[0] Output Gain:0
-        channel_hex = self.channel_to_hex(output_channel)
-        result = self.to_string(self.send("FF550210" + channel_hex))
-        return float(result.split(':')[1])
+        index = self.channel_index(output_channel)
+        return self._command(GET_OUTPUT_GAIN_FRAMES[index], OUTPUT_GAIN_REPLIES[index], self.parse_gain,
+                             cache_key=(EVENT_OUTPUT_GAIN, output_channel))
 
     def set_output_source(self, output_channel: int, input_channel: int):
         # Cmd:ChannelOutputSource ,Channel Output 1
-        output_hex = self.channel_to_hex(output_channel)
-        input_hex = self.channel_to_hex(input_channel)
-        return self.to_string(self.send("FF5503F4" + output_hex + input_hex))
+        index = self.channel_index(output_channel)
+        input_index = self.channel_index(input_channel)
+        return self._command(SET_OUTPUT_SOURCE_FRAMES[index][input_index], OUTPUT_SOURCE_ACKS[index])
 
     def set_stereo_mono(self, input_channel: int, stereo: StereoMono):
         # Cmd:ChannelStereoMono ,Channel Input 1
-        channel_hex = self.channel_to_hex(input_channel)
-        return self.to_string(self.send("FF5503F5" + channel_hex + stereo.value))
+        index = self.channel_index(input_channel)
+        return self._command(encode(OP_STEREO_MONO, index, stereo.value), STEREO_MONO_ACKS[index])
 
     def set_bridge(self, output_channel: int, bridged: Bridge):
         # Cmd:ChannelBridge ,Channel Output 1
-        channel_hex = self.channel_to_hex(output_channel)
-        return self.to_string(self.send("FF5503F6" + channel_hex + bridged.value))
+        index = self.channel_index(output_channel)
+        return self._command(encode(OP_BRIDGE, index, bridged.value), BRIDGE_ACKS[index])
 
     def set_output_mute(self, output_channel: int, muted: bool):
         # Cmd:ChannelMute ,Channel Output 1
-        channel_hex = self.channel_to_hex(output_channel)
-        code = {True: "00", False: "01"}[muted]
-        return self.to_string(self.send("FF5503F7" + channel_hex + code))
+        index = self.channel_index(output_channel)
+        return self._command(SET_OUTPUT_MUTE_FRAMES[index][not muted], OUTPUT_MUTE_ACKS[index],
+                             writes=((EVENT_OUTPUT_MUTE, output_channel), muted))
 
     def get_output_mute(self, output_channel: int):
         # Channel[0] Mute Status:Unmute
-        channel_hex = self.channel_to_hex(output_channel)
-        mute_string = self.to_string(self.send("FF550212" + channel_hex)).split(':')[1]
-        return mute_string == "Mute"
+        index = self.channel_index(output_channel)
+        return self._command(GET_OUTPUT_MUTE_FRAMES[index], OUTPUT_MUTE_REPLIES[index], self.parse_mute,
+                             cache_key=(EVENT_OUTPUT_MUTE, output_channel))
 
     # DSP
     def set_output_preset(self, output_channel: int, preset_index=0):
         # Cmd:ChannelOutputPreset ,Channel Output 1
-        channel_hex = self.channel_to_hex(output_channel)
-        preset_hex = self.preset_to_hex(preset_index)
-        return self.to_string(self.send("FF5503F3" + channel_hex + preset_hex))
+        index = self.channel_index(output_channel)
+        return self._command(SET_OUTPUT_PRESET_FRAMES[index][self.preset_index(preset_index)],
+                             OUTPUT_PRESET_ACKS[index])
 
     # Settings
     def set_power_method(self, power_method: PowerMethod):
         # Power mode:Power Button
-        return self.to_string(self.send("FF5502F8" + power_method.value))
+        return self._command(encode(OP_POWER_METHOD, power_method.value), b"Power mode:")
 
     def set_green_mode(self, green: bool):
         # Green mode:off
-        code = {True: "01", False: "00"}[green]
-        return self.to_string(self.send("FF5502F9" + code))
+        return self._command(encode(OP_GREEN_MODE, int(green)), b"Green mode:")
 
     def set_delay_time(self, delay: int):
         # AutoOnDelayTime:0
-        delay_hex = self.delay_time_to_hex(delay)
-        return self.to_string(self.send("FF5502FA" + delay_hex))
+        return self._command(encode(OP_DELAY_TIME, self.delay_step(delay)), b"AutoOnDelayTime:")
 
     def reset(self):
         # Wait system reset all
-        return self.to_string(self.send("FF5501FB"))
+        return self._command(RESET_FRAME, b"Wait system reset")
 
     def power_on(self):
         # Cmd:PowerOn
-        return self.to_string(self.send("FF550101"))
+        return self._command(POWER_ON_FRAME, POWER_ON_ACK)
 
     def power_off(self):
         # Cmd:PowerOff
-        return self.to_string(self.send("FF550102"))
+        return self._command(POWER_OFF_FRAME, POWER_OFF_ACK)
 
     def power_toggle(self):
         # Cmd:PowerToggle
-        return self.to_string(self.send("FF550103"))
+        return self._command(POWER_TOGGLE_FRAME, b"Cmd:PowerToggle")
 
     def get_power_status(self):
         # Power status:On
-        return self.to_string(self.send("FF550170"))
+        return self._command(POWER_STATUS_FRAME, POWER_STATUS)
+
+    def test_command(self, command: str, reply: str | None = None):
+        return self._command(bytes.fromhex(command), reply.encode() if reply is not None else None)
+
+
+class NadBatch(NadCommands):
+    """Collects commands from the shared table, to be written to the amp together.
+
+    batch = client.batch()
+    batch.get_output_gain(1)
+    batch.get_output_mute(1)
+    gain, muted = await batch.execute()
+    """
 
-    def read_in_out(self):
-        return requests.get(f"http://{self.ip}/Web/Handler.php?page=in-out&action=read").json()
+    def __init__(self, client: "AsyncNadClient"):
+        self._ip = client.ip
+        self._client = client
+        self.commands: list[NadCommand] = []
 
-    def test_command(self, command: str):
-        return self.to_string(self.send(command))
+    def _command(self, frame: bytes, reply=None, parse=None, cache_key=None, writes=None):
+        self.commands.append(NadCommand(frame, reply, parse, cache_key, writes))
+        return len(self.commands) - 1
+
+    async def execute(self, use_cache=True):
+        return await self._client.execute_many(self.commands, use_cache)
+
+
+class AsyncNadClient(NadCommands):
+    """Asyncio client, every command method returns an awaitable.
+
+    Commands go through a priority queue. User commands go before the reads of polling, and
+    everything of them that is queued is written at once, so a batch takes a single round trip.
+    Polling reads are written for as far as `pipeline_window` allows: enough to keep the amp
+    busy for a round trip, so a refresh takes about as long as when written at once, while a
+    user command never queues behind more than a round trip of reads. A read of a value that is already queued
+    shares the queued command. Commands that were not sent within `queue_timeout` seconds are dropped.
+
+    When the connection drops it reconnects with jittered exponential backoff. Meanwhile at
+    most MAX_QUEUED_COMMANDS are queued, to be sent once the connection is back. An idle
+    connection is probed every `heartbeat_interval` seconds, and right away when a reply times out,
+    so a stalled link is dropped (and reconnected) within seconds of the probe. The power status
+    the probe reads is handed to the listeners.
+
+    Output gains and mutes are cached for `cache_ttl` seconds: acknowledged writes and pushed
+    values update the cache, reads within the TTL do not reach the amp.
+
+    The web interface is read from `web_url`, which defaults to http on the same address.
+
+    Clients sharing a `limiter` never have more commands awaiting a reply than its limit together,
+    larger batches are written in parts of that size.
+    """
+
+    def __init__(self, ip: str, port=DEFAULT_TCP_PORT, timeout=DEFAULT_TIMEOUT, queue_timeout=QUEUE_TIMEOUT,
+                 cache_ttl=DEFAULT_CACHE_TTL, session: aiohttp.ClientSession | None = None,
+                 limiter: InFlightLimiter | None = None, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 web_url: str | None = None):
+        self._ip = ip
+        self._web_url = web_url or f"http://{ip}"
+        self._session = session
+        self._owns_session = session is None
+        self._port = port
+        self._timeout = timeout
+        self._queue_timeout = queue_timeout
+        self._limiter = limiter
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._reconnect_task = None
+        self._closing = False
+        self._connected = asyncio.Event()
+        self._queue: list[_QueuedCommand] = []
+        self._queued_reads: dict[tuple, _QueuedCommand] = {}
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._wakeup = asyncio.Event()
+        self._send_task = None
+        self._heartbeat_task = None
+        self._heartbeat_interval = heartbeat_interval
+        self._probe = asyncio.Event()
+        self._last_received = 0.0
+        self.rtt: float | None = None
+        self.reply_interval: float | None = None
+        self._last_reply_at = 0.0
+        self._framer = NadFramer()
+        self._correlator = ReplyCorrelator()
+        self._listeners: list[Callable[[NadEvent], None]] = []
+        self.cache = StateCache(cache_ttl)
+        self.metrics = ClientMetrics()
+        self.stats = CommandStats()
+        self.output_gain_writer = WriteCoalescer(self.set_output_gain, self.quantize_gain)
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def add_listener(self, listener: Callable[[NadEvent], None]) -> Callable[[], None]:
+        """Get called with every state change the amp reports on its own, returns a remover."""
+        self._listeners.append(listener)
+        return lambda: self._listeners.remove(listener)
+
+    async def connect(self):
+        self._closing = False
+        await self._open()
+
+    async def _open(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self._ip, self._port), self._timeout
+        )
+        self._enable_keepalive()
+        self._framer.reset()
+        loop = asyncio.get_running_loop()
+        self._last_received = loop.time()
+        self._probe.clear()
+        self._read_task = loop.create_task(self._read_loop(self._reader))
+        if self._send_task is None:
+            self._send_task = loop.create_task(self._send_loop())
+        if self._heartbeat_task is None:
+            self._heartbeat_task = loop.create_task(self._heartbeat_loop())
+        self._connected.set()
+        self._wakeup.set()
+
+    def _enable_keepalive(self):
+        sock = self._writer.get_extra_info("socket")
+        if sock is None:
+            return
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # Not every platform has these
+        for option, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+                              ("TCP_KEEPCNT", KEEPALIVE_COUNT)):
+            if hasattr(socket, option):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        loop = asyncio.get_running_loop()
+        try:
+            while data := await reader.read(BUFFER_SIZE):
+                self._last_received = loop.time()
+                for frame in self._framer.feed(data):
+                    if not self._correlator.resolve(frame):
+                        self._on_unsolicited(frame)
+        except OSError as e:
+            _LOGGER.warning(f"Lost connection to NAD server at {self.ip}: {str(e)}")
+
+        # A writer failing may already have dropped this connection
+        if reader is self._reader:
+            self._connection_lost()
+
+    def _connection_lost(self):
+        if self._closing or not self._connected.is_set():
+            return
+
+        _LOGGER.warning(f"Disconnected from NAD server at {self.ip}, reconnecting")
+        self._connected.clear()
+        self._correlator.fail_all(ConnectionError(f"Connection to {self.ip} closed"))
+        self.cache.invalidate()
+        self._writer.close()
+        self._reader = self._writer = None
+        self._notify(NadEvent(EVENT_CONNECTION, value=False))
+        self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    @property
+    def heartbeat_timeout(self) -> float:
+        if self.rtt is None:
+            return self._timeout
+        return min(self._timeout, max(HEARTBEAT_MIN_TIMEOUT, 4 * self.rtt))
+
+    async def _heartbeat_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._connected.wait()
+            idle = loop.time() - self._last_received
+            if idle < self._heartbeat_interval and not self._probe.is_set():
+                try:
+                    await asyncio.wait_for(self._probe.wait(), self._heartbeat_interval - idle)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._probe.clear()
+            try:
+                reply = await asyncio.wait_for(self.send(POWER_STATUS_FRAME, POWER_STATUS), self.heartbeat_timeout)
+            except asyncio.TimeoutError:
+                reply = None
+
+            if reply is None:
+                if self._connected.is_set():
+                    _LOGGER.warning(f"NAD server at {self.ip} did not answer the heartbeat")
+                    self._connection_lost()
+                continue
+
+            self._notify(parse_event(reply))
+
+    async def _reconnect(self):
+        attempt = 0
+        while not self._closing:
+            delay = min(RECONNECT_MAX_DELAY, RECONNECT_MIN_DELAY * 2 ** attempt)
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+            try:
+                await self._open()
+            except (OSError, asyncio.TimeoutError) as e:
+                attempt += 1
+                _LOGGER.debug(f"Reconnecting to NAD server at {self.ip} failed: {str(e)}")
+                continue
+
+            _LOGGER.info(f"Reconnected to NAD server at {self.ip}")
+            self.metrics.reconnects += 1
+            self._notify(NadEvent(EVENT_CONNECTION, value=True))
+            return
+
+    def _on_unsolicited(self, frame: memoryview):
+        event = parse_event(frame)
+        if event is None:
+            _LOGGER.debug(f"Ignoring unsolicited reply from {self.ip}: {frame.tobytes()}")
+            return
+
+        if event.channel is not None:
+            if event.value is None:
+                self.cache.invalidate((event.kind, event.channel))
+            else:
+                self.cache.set((event.kind, event.channel), event.value)
+        self._notify(event)
+
+    def _notify(self, event: NadEvent):
+        for listener in list(self._listeners):
+            try:
+                listener(event)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception(f"Error handling {event}")
+
+    async def close(self):
+        self._closing = True
+        self._connected.clear()
+        for task in (self._reconnect_task, self._read_task, self._send_task, self._heartbeat_task):
+            if task is not None:
+                task.cancel()
+        self._reconnect_task = self._read_task = self._send_task = self._heartbeat_task = None
+        self._correlator.fail_all(ConnectionError(f"Connection to {self.ip} closed"))
+        queue, self._queue = self._queue, []
+        self._queued_reads.clear()
+        for queued in queue:
+            queued.resolve(None)
+
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+        if self._writer is None:
+            return
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except OSError:
+            pass
+        self._reader = self._writer = None
+
+    async def send(self, frame: bytes, reply=None):
+        return (await self.send_many([NadCommand(frame, reply)]))[0]
+
+    async def send_many(self, commands: list[NadCommand]) -> list[memoryview | None]:
+        """Queue the commands and collect their replies in order."""
+        if self._closing or not self._connected.is_set() and len(self._queue) + len(commands) > MAX_QUEUED_COMMANDS:
+            _LOGGER.warning(f"Not connected to NAD server at {self.ip}, dropping {len(commands)} command(s)")
+            self.metrics.commands_dropped += len(commands)
+            return [None] * len(commands)
+
+        waiters = [self._enqueue(command) for command in commands]
+        self._wakeup.set()
+        return list(await asyncio.gather(*waiters))
+
+    def _enqueue(self, command: NadCommand) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        queued = self._queued_reads.get(command.cache_key) if command.cache_key is not None else None
+        if queued is not None and not queued.done:
+            queued.waiters.append(waiter)
+            waiter.add_done_callback(partial(self._on_waiter_done, queued))
+            return waiter
+
+        priority = PRIORITY_BACKGROUND if command.frame[3] in BACKGROUND_OPCODES else PRIORITY_USER
+        queued = _QueuedCommand(priority, next(self._sequence), command, [waiter])
+        queued.expiry = loop.call_later(self._queue_timeout, self._expire, queued)
+        waiter.add_done_callback(partial(self._on_waiter_done, queued))
+        heapq.heappush(self._queue, queued)
+        if command.cache_key is not None:
+            self._queued_reads[command.cache_key] = queued
+        return waiter
+
+    def _expire(self, queued: _QueuedCommand):
+        if queued.done:
+            return
+        _LOGGER.warning(f"Dropping {queued.command.frame.hex().upper()} to {self.ip}, it was queued too long")
+        self.metrics.commands_dropped += 1
+        self._dequeue(queued)
+        queued.resolve(None)
+
+    def _on_waiter_done(self, queued: _QueuedCommand, waiter: asyncio.Future):
+        # Nobody is waiting for a command that is still queued anymore, so it does not need to be sent
+        if waiter.cancelled() and not queued.done and queued.abandoned and self._dequeue(queued):
+            queued.resolve(None)
+
+    def _dequeue(self, queued: _QueuedCommand) -> bool:
+        """Take a command out of the queue before it was sent, so it no longer counts against its bound."""
+        self._forget(queued)
+        try:
+            self._queue.remove(queued)
+        except ValueError:
+            return False
+        heapq.heapify(self._queue)
+        return True
+
+    def _forget(self, queued: _QueuedCommand):
+        key = queued.command.cache_key
+        if key is not None and self._queued_reads.get(key) is queued:
+            del self._queued_reads[key]
+
+    def _take(self) -> list[_QueuedCommand]:
+        """The queued user commands, and polling reads for as far as the pipeline window allows."""
+        limit = self._limiter.limit if self._limiter is not None else len(self._queue)
+        taken = []
+        while self._queue and len(taken) < limit:
+            if (self._queue[0].priority == PRIORITY_BACKGROUND
+                    and self._in_flight + len(taken) >= self.pipeline_window):
+                break
+            queued = heapq.heappop(self._queue)
+            self._forget(queued)
+            if queued.done or queued.abandoned:
+                queued.resolve(None)
+                continue
+            taken.append(queued)
+        return taken
+
+    @property
+    def pipeline_window(self) -> int:
+        if self.rtt is None or self.reply_interval is None:
+            return PIPELINE_WINDOW
+        return min(MAX_PIPELINE_WINDOW, math.ceil(self.rtt / max(self.reply_interval, MIN_REPLY_INTERVAL)))
+
+    def _observe_timing(self, sent_at: float, ahead: int, received_at: float):
+        """The reply to a command sent with nothing ahead of it measures the round trip, others
+        were queued behind the previous reply and measure the interval between replies."""
+        if not ahead:
+            self.rtt = self._smooth(self.rtt, received_at - sent_at)
+        else:
+            self.reply_interval = self._smooth(self.reply_interval, received_at - max(sent_at, self._last_reply_at))
+        self._last_reply_at = received_at
+
+    @staticmethod
+    def _smooth(average: float | None, sample: float) -> float:
+        return sample if average is None else (1 - RTT_SMOOTHING) * average + RTT_SMOOTHING * sample
+
+    async def _send_loop(self):
+        """Write what may be sent from the queue, highest priority first."""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._connected.is_set():
+                continue
+
+            taken = self._take()
+            if not taken:
+                continue
+            if self._limiter is not None:
+                await self._limiter.acquire(len(taken))
+            self._transmit(taken)
+            # There may be more to send than fitted in the window or the limiter
+            self._wakeup.set()
+
+    def _transmit(self, taken: list[_QueuedCommand]):
+        if self._writer is None:
+            # The connection dropped while waiting for the limiter, back in the queue they go
+            if self._limiter is not None:
+                self._limiter.release(len(taken))
+            for queued in taken:
+                heapq.heappush(self._queue, queued)
+            return
+
+        loop = asyncio.get_running_loop()
+        sent_at = loop.time()
+        for ahead, queued in enumerate(taken, self._in_flight):
+            queued.expiry.cancel()
+            reply = self._correlator.expect(queued.command.reply)
+            timeout = loop.call_later(self._timeout, reply.cancel)
+            reply.add_done_callback(partial(self._on_reply, queued, sent_at, ahead, timeout))
+        self._in_flight += len(taken)
+        self.metrics.commands_sent += len(taken)
+        self._writer.write(b"".join([queued.command.frame for queued in taken]))
+
+    def _on_reply(self, queued: _QueuedCommand, sent_at: float, ahead: int, timeout: asyncio.TimerHandle,
+                  reply: asyncio.Future):
+        timeout.cancel()
+        self._correlator.discard(reply)
+        self._in_flight -= 1
+        if self._limiter is not None:
+            self._limiter.release(1)
+        self._wakeup.set()
+
+        command = queued.command
+        stats = self.stats[command.frame[3]]
+        stats.commands += 1
+        stats.bytes_sent += len(command.frame)
+        if reply.cancelled() or reply.exception() is not None:
+            _LOGGER.warning(f"No reply from NAD server at {self.ip} to {command.frame.hex().upper()}")
+            self.metrics.replies_missed += 1
+            if reply.cancelled():
+                stats.timeouts += 1
+                # The amp may have stopped answering altogether, the heartbeat finds out
+                self._probe.set()
+            else:
+                stats.errors += 1
+            queued.resolve(None)
+            return
+
+        frame = reply.result()
+        received_at = asyncio.get_running_loop().time()
+        self._observe_timing(sent_at, ahead, received_at)
+        # Including the NUL terminator
+        stats.observe(received_at - sent_at, len(frame) + 1)
+        queued.resolve(frame)
+
+    async def execute_many(self, commands: list[NadCommand], use_cache=True) -> list:
+        """Like send_many, but returns the parsed replies and goes through the state cache.
+
+        Without `use_cache` every read goes to the amp, its reply still updates the cache.
+        """
+        results = [
+            self.cache.get(command.cache_key) if use_cache and command.cache_key else _MISSING for command in commands
+        ]
+        uncached = [index for index, result in enumerate(results) if result is _MISSING]
+        if not uncached:
+            return results
+
+        replies = await self.send_many([commands[index] for index in uncached])
+        for index, reply in zip(uncached, replies):
+            command = commands[index]
+            results[index] = result = self._parse_response(reply, command.reply, command.parse)
+            if result is None:
+                continue
+            if command.cache_key is not None:
+                self.cache.set(command.cache_key, result)
+            if command.writes is not None:
+                self.cache.set(*command.writes)
+                (kind, channel), value = command.writes
+                if kind == EVENT_OUTPUT_GAIN:
+                    # Whichever way the gain was written, the coalescer must not skip writing it back
+                    self.output_gain_writer.confirm(channel, value)
+        return results
+
+    async def read_page(self, page: str, action="read"):
+        """Read a page of the web interface's Handler.php, over a pooled keep-alive session."""
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+
+        async with self._session.get(
+                f"{self._web_url}/Web/Handler.php",
+                params={"page": page, "action": action},
+                timeout=HTTP_TIMEOUT
+        ) as response:
+            response.raise_for_status()
+            # Handler.php does not always send a JSON content type
+            return await response.json(content_type=None)
+
+    async def read_in_out(self):
+        return await self.read_page("in-out")
+
+    def batch(self) -> NadBatch:
+        return NadBatch(self)
+
+    async def set_group(self, output_channels: list[int], gain: float | None = None, muted: bool | None = None,
+                        source: int | None = None, preset: int | None = None) -> list:
+        """Change several outputs at once, all commands are written to the amp in a single burst."""
+        batch = self.batch()
+        for channel in output_channels:
+            if gain is not None:
+                batch.set_output_gain(channel, gain)
+            if muted is not None:
+                batch.set_output_mute(channel, muted)
+            if source is not None:
+                batch.set_output_source(channel, source)
+            if preset is not None:
+                batch.set_output_preset(channel, preset)
+
+        if not batch.commands:
+            return []
+        return await batch.execute()
+
+    async def _command(self, frame: bytes, reply=None, parse=None, cache_key=None, writes=None):
+        return (await self.execute_many([NadCommand(frame, reply, parse, cache_key, writes)]))[0]
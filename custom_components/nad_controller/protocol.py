@@ -0,0 +1,222 @@
+"""Encoding, framing and reply correlation for the NAD TCP protocol.
+
+Everything here works on bytes: command frames are prebuilt at import, and reply frames are
+memoryview slices of what was read from the socket.
+"""
+import asyncio
+import re
+from dataclasses import dataclass
+from typing import Any
+
+FRAME_TERMINATOR = 0
+CHANNELS = 16
+GAIN_STEPS = 25  # -6 dB up to 6 dB in steps of 0.5 dB
+PRESETS = 10
+
+# Identification
+OP_DEVICE_NAME = 0xE0
+OP_DEVICE_MODEL = 0xE1
+OP_PROJECT_NAME = 0xE2
+OP_INSTALLATION_DATE = 0xE4
+OP_FIRMWARE_VERSION = 0xE5
+OP_SERIAL_NUMBER = 0xE6
+OP_FLASH_LED = 0xEB
+OP_DHCP = 0xEC
+OP_IP_ADDRESS = 0xED
+OP_SUBNET_MASK = 0xEE
+# Control
+OP_GLOBAL_CONTROL = 0xF0
+OP_INPUT_GAIN = 0xF1
+OP_OUTPUT_GAIN = 0xF2
+OP_OUTPUT_PRESET = 0xF3
+OP_OUTPUT_SOURCE = 0xF4
+OP_STEREO_MONO = 0xF5
+OP_BRIDGE = 0xF6
+OP_OUTPUT_MUTE = 0xF7
+OP_GET_OUTPUT_GAIN = 0x10
+OP_GET_OUTPUT_MUTE = 0x12
+# Settings
+OP_POWER_METHOD = 0xF8
+OP_GREEN_MODE = 0xF9
+OP_DELAY_TIME = 0xFA
+OP_RESET = 0xFB
+OP_POWER_ON = 0x01
+OP_POWER_OFF = 0x02
+OP_POWER_TOGGLE = 0x03
+OP_POWER_STATUS = 0x70
+
+
+def encode(opcode: int, *args: int) -> bytes:
+    """FF 55, the length of what follows, the opcode and its arguments."""
+    return bytes((0xFF, 0x55, len(args) + 1, opcode, *args))
+
+
+# The frames of the hot path, indexed by zero based channel and then argument
+SET_INPUT_GAIN_FRAMES = [[encode(OP_INPUT_GAIN, c, g) for g in range(GAIN_STEPS)] for c in range(CHANNELS)]
+SET_OUTPUT_GAIN_FRAMES = [[encode(OP_OUTPUT_GAIN, c, g) for g in range(GAIN_STEPS)] for c in range(CHANNELS)]
+SET_OUTPUT_SOURCE_FRAMES = [[encode(OP_OUTPUT_SOURCE, c, i) for i in range(CHANNELS)] for c in range(CHANNELS)]
+SET_OUTPUT_PRESET_FRAMES = [[encode(OP_OUTPUT_PRESET, c, p) for p in range(PRESETS)] for c in range(CHANNELS)]
+# Muting is 00 and unmuting 01, so these are indexed by `not muted`
+SET_OUTPUT_MUTE_FRAMES = [[encode(OP_OUTPUT_MUTE, c, m) for m in range(2)] for c in range(CHANNELS)]
+GET_OUTPUT_GAIN_FRAMES = [encode(OP_GET_OUTPUT_GAIN, c) for c in range(CHANNELS)]
+GET_OUTPUT_MUTE_FRAMES = [encode(OP_GET_OUTPUT_MUTE, c) for c in range(CHANNELS)]
+
+# Their replies, indexed by zero based channel
+OUTPUT_GAIN_REPLIES = [b"Channel[%d] Output Gain:" % c for c in range(CHANNELS)]
+OUTPUT_MUTE_REPLIES = [b"Channel[%d] Mute Status:" % c for c in range(CHANNELS)]
+INPUT_GAIN_ACKS = [b"Cmd:ChannelInputGain ,Channel Input %d" % (c + 1) for c in range(CHANNELS)]
+OUTPUT_GAIN_ACKS = [b"Cmd:ChannelOutputGain ,Channel Output %d" % (c + 1) for c in range(CHANNELS)]
+OUTPUT_SOURCE_ACKS = [b"Cmd:ChannelOutputSource ,Channel Output %d" % (c + 1) for c in range(CHANNELS)]
+OUTPUT_PRESET_ACKS = [b"Cmd:ChannelOutputPreset ,Channel Output %d" % (c + 1) for c in range(CHANNELS)]
+STEREO_MONO_ACKS = [b"Cmd:ChannelStereoMono ,Channel Input %d" % (c + 1) for c in range(CHANNELS)]
+BRIDGE_ACKS = [b"Cmd:ChannelBridge ,Channel Output %d" % (c + 1) for c in range(CHANNELS)]
+OUTPUT_MUTE_ACKS = [b"Cmd:ChannelMute ,Channel Output %d" % (c + 1) for c in range(CHANNELS)]
+
+# Replies starting with these are status lines, so they are never handed to a
+# command that did not say what its reply looks like (like the identification ones).
+STATUS_PREFIXES = (
+    b"Cmd:",
+    b"Channel[",
+    b"Power status:",
+    b"Power mode:",
+    b"Green mode:",
+    b"AutoOnDelayTime:",
+    b"Flash LED:",
+    b"IP Method:",
+    b"Set Global",
+)
+POWER_STATUS = b"Power status:"
+POWER_STATUS_ON = b"Power status:On"
+POWER_ON_ACK = b"Cmd:PowerOn"
+POWER_OFF_ACK = b"Cmd:PowerOff"
+
+
+EVENT_CONNECTION = "connection"
+EVENT_POWER = "power"
+EVENT_OUTPUT_GAIN = "output_gain"
+EVENT_OUTPUT_MUTE = "output_mute"
+
+_CHANNEL_GAIN = re.compile(rb"Channel\[(\d+)] Output Gain:(-?\d+(?:\.\d+)?)")
+_CHANNEL_MUTE = re.compile(rb"Channel\[(\d+)] Mute Status:(Mute|Unmute)")
+_CHANNEL_COMMAND = re.compile(rb"Cmd:Channel(OutputGain|Mute) ,Channel Output (\d+)")
+
+
+@dataclass
+class NadEvent:
+    """A state change reported by the amp, `value` is None when it has to be queried."""
+    kind: str
+    channel: int | None = None
+    value: Any = None
+
+
+def starts_with(frame: memoryview, prefix: bytes) -> bool:
+    return frame[:len(prefix)] == prefix
+
+
+def parse_event(frame: memoryview) -> NadEvent | None:
+    if starts_with(frame, POWER_STATUS):
+        return NadEvent(EVENT_POWER, value=frame == POWER_STATUS_ON)
+    if frame == POWER_ON_ACK or frame == POWER_OFF_ACK:
+        return NadEvent(EVENT_POWER, value=frame == POWER_ON_ACK)
+
+    if match := _CHANNEL_GAIN.fullmatch(frame):
+        return NadEvent(EVENT_OUTPUT_GAIN, int(match.group(1)) + 1, float(match.group(2)))
+    if match := _CHANNEL_MUTE.fullmatch(frame):
+        return NadEvent(EVENT_OUTPUT_MUTE, int(match.group(1)) + 1, match.group(2) == b"Mute")
+
+    if match := _CHANNEL_COMMAND.fullmatch(frame):
+        kind = EVENT_OUTPUT_GAIN if match.group(1) == b"OutputGain" else EVENT_OUTPUT_MUTE
+        return NadEvent(kind, int(match.group(2)))
+
+    return None
+
+
+class NadFramer:
+    """Splits the reply byte stream of the amp into NUL terminated frames.
+
+    Frames are memoryviews on the data that was fed, only an incomplete frame at the end is copied.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[memoryview]:
+        end = data.find(FRAME_TERMINATOR)
+        if end < 0:
+            self._buffer += data
+            return []
+
+        view = memoryview(data)
+        frames = []
+        start = 0
+        if self._buffer:
+            # Complete the frame that was cut off by the previous read, the rest of the data is not copied
+            self._buffer += view[:end]
+            frames.append(memoryview(bytes(self._buffer)))
+            self._buffer.clear()
+            start = end + 1
+            end = data.find(FRAME_TERMINATOR, start)
+
+        while end >= 0:
+            if end > start:
+                frames.append(view[start:end])
+            start = end + 1
+            end = data.find(FRAME_TERMINATOR, start)
+        self._buffer += view[start:]
+        return frames
+
+    def reset(self):
+        self._buffer.clear()
+
+
+def reply_matches(frame: memoryview, reply: bytes | None) -> bool:
+    """Check whether a frame is the reply described by the expected prefix.
+
+    A prefix ending in a digit must not be followed by another one,
+    so that `Channel Output 1` does not match `Channel Output 12`.
+    """
+    if reply is None:
+        return not any(starts_with(frame, prefix) for prefix in STATUS_PREFIXES)
+
+    length = len(reply)
+    if frame[:length] != reply:
+        return False
+    return not (0x30 <= reply[-1] <= 0x39 and len(frame) > length and 0x30 <= frame[length] <= 0x39)
+
+
+class ReplyCorrelator:
+    """Matches incoming frames to the oldest command waiting for that reply."""
+
+    def __init__(self):
+        self._pending: list[tuple[bytes | None, asyncio.Future]] = []
+
+    def expect(self, reply: bytes | None) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((reply, future))
+        return future
+
+    def discard(self, future: asyncio.Future):
+        self._pending = [(reply, f) for reply, f in self._pending if f is not future]
+
+    def resolve(self, frame: memoryview) -> bool:
+        """Hand the frame to its command, returns False if nobody asked for it."""
+        for index, (reply, future) in enumerate(self._pending):
+            if reply is not None and reply_matches(frame, reply):
+                break
+        else:
+            for index, (reply, future) in enumerate(self._pending):
+                if reply is None and reply_matches(frame, reply):
+                    break
+            else:
+                return False
+
+        del self._pending[index]
+        if not future.done():
+            future.set_result(frame)
+        return True
+
+    def fail_all(self, exception: Exception):
+        pending, self._pending = self._pending, []
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(exception)
@@ -0,0 +1,124 @@
+"""Diagnostic sensors on the commands sent to a NAD multi-room audio controller."""
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorEntityDescription,
+    SensorStateClass,
+)
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_NAME, EntityCategory, UnitOfInformation, UnitOfTime
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity import DeviceInfo
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from . import CONF_COORDINATOR
+from .config_flow import DOMAIN, CONF_SERIAL_NUMBER
+from .coordinator import NadCoordinator
+from .entity import NadEntity
+from .stats import OpcodeStats
+
+
+@dataclass(frozen=True, kw_only=True)
+class NadSensorEntityDescription(SensorEntityDescription):
+    value_fn: Callable[[OpcodeStats], float | int | None]
+
+
+def _milliseconds(seconds: float | None) -> float | None:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+SENSORS = (
+    NadSensorEntityDescription(
+        key="command_latency",
+        name="Command latency",
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda stats: _milliseconds(stats.mean_latency),
+    ),
+    NadSensorEntityDescription(
+        key="command_latency_p95",
+        name="Command latency 95th percentile",
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda stats: _milliseconds(stats.percentile(0.95)),
+    ),
+    NadSensorEntityDescription(
+        key="commands",
+        name="Commands",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda stats: stats.commands,
+    ),
+    NadSensorEntityDescription(
+        key="command_timeouts",
+        name="Command timeouts",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda stats: stats.timeouts,
+    ),
+    NadSensorEntityDescription(
+        key="command_errors",
+        name="Command errors",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda stats: stats.errors,
+    ),
+    NadSensorEntityDescription(
+        key="bytes_sent",
+        name="Bytes sent",
+        device_class=SensorDeviceClass.DATA_SIZE,
+        native_unit_of_measurement=UnitOfInformation.BYTES,
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        entity_registry_enabled_default=False,
+        value_fn=lambda stats: stats.bytes_sent,
+    ),
+    NadSensorEntityDescription(
+        key="bytes_received",
+        name="Bytes received",
+        device_class=SensorDeviceClass.DATA_SIZE,
+        native_unit_of_measurement=UnitOfInformation.BYTES,
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        entity_registry_enabled_default=False,
+        value_fn=lambda stats: stats.bytes_received,
+    ),
+)
+
+
+async def async_setup_entry(
+        hass: HomeAssistant,
+        config_entry: ConfigEntry,
+        async_add_entities: AddEntitiesCallback,
+) -> None:
+    coordinator: NadCoordinator = hass.data[DOMAIN][config_entry.entry_id][CONF_COORDINATOR]
+    async_add_entities(
+        NadCommandSensor(coordinator, config_entry.data[CONF_NAME], config_entry.data[CONF_SERIAL_NUMBER], description)
+        for description in SENSORS
+    )
+
+
+class NadCommandSensor(NadEntity, SensorEntity):
+    """Sums up the command stats of all opcodes, updated with every coordinator update."""
+    entity_description: NadSensorEntityDescription
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def __init__(self, coordinator: NadCoordinator, device_name: str, serial_number: str,
+                 description: NadSensorEntityDescription):
+        super().__init__(coordinator)
+        self.entity_description = description
+        self._attr_unique_id = f"{DOMAIN}_{serial_number}_{description.key}"
+        self._attr_name = f"{device_name} {description.name}"
+        self._attr_device_info = DeviceInfo(identifiers={(DOMAIN, serial_number)})
+
+    @property
+    def available(self) -> bool:
+        # The stats are known, also when the amp is not
+        return True
+
+    @property
+    def native_value(self) -> float | int | None:
+        return self.entity_description.value_fn(self.coordinator.client.stats.total())
+
+    def _state_key(self) -> tuple:
+        return (self.native_value,)
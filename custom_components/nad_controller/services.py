@@ -0,0 +1,133 @@
+"""Services of the NAD multi-room audio controller integration."""
+import asyncio
+
+import homeassistant.helpers.config_validation as cv
+import voluptuous as vol
+from homeassistant.const import ATTR_ENTITY_ID
+from homeassistant.core import HomeAssistant, ServiceCall
+
+from .config_flow import DOMAIN
+from .snapshot import SnapshotStore
+
+SERVICE_SET_GROUP = "set_group"
+SERVICE_SNAPSHOT = "snapshot"
+SERVICE_RESTORE = "restore"
+
+ATTR_GAIN = "gain"
+ATTR_MUTE = "mute"
+ATTR_SOURCE = "source"
+ATTR_PRESET = "preset"
+
+SET_GROUP_SCHEMA = vol.All(
+    vol.Schema({
+        vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+        vol.Optional(ATTR_GAIN): vol.All(vol.Coerce(float), vol.Range(min=-6, max=6)),
+        vol.Optional(ATTR_MUTE): cv.boolean,
+        vol.Optional(ATTR_SOURCE): cv.string,
+        vol.Optional(ATTR_PRESET): cv.string,
+    }),
+    vol.Has_at_least_one_key(ATTR_GAIN, ATTR_MUTE, ATTR_SOURCE, ATTR_PRESET),
+)
+SNAPSHOT_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_ENTITY_ID): cv.entity_ids,
+})
+
+
+def _channels_by_coordinator(hass: HomeAssistant, entity_ids: list[str]):
+    """Find the channel entities of every amp among the given entity ids."""
+    from . import CONF_CHANNELS, CONF_COORDINATOR
+
+    for entry in hass.config_entries.async_entries(DOMAIN):
+        data = hass.data[DOMAIN].get(entry.entry_id)
+        if data is None:
+            continue
+        channels = [channel for channel in data.get(CONF_CHANNELS, []) if channel.entity_id in entity_ids]
+        if channels:
+            yield data[CONF_COORDINATOR], channels
+
+
+def _amps(hass: HomeAssistant, entity_ids: list[str] | None):
+    """Find the amps that have one of the given entities, or all of them when no entities are given."""
+    from . import CONF_AMP, CONF_CHANNELS, CONF_COORDINATOR
+
+    for entry in hass.config_entries.async_entries(DOMAIN):
+        data = hass.data[DOMAIN].get(entry.entry_id)
+        if data is None or CONF_AMP not in data:
+            continue
+        entities = [data[CONF_AMP], *data[CONF_CHANNELS]]
+        if entity_ids is None or any(entity.entity_id in entity_ids for entity in entities):
+            yield entry.entry_id, data[CONF_COORDINATOR], data[CONF_CHANNELS]
+
+
+async def _async_snapshot(hass: HomeAssistant, entry_id: str, channels):
+    snapshots = {channel.output_channel: channel.take_snapshot() for channel in channels}
+    await SnapshotStore(hass, entry_id).async_save(snapshots)
+
+
+async def _async_restore(coordinator, channels):
+    batch = coordinator.client.batch()
+    changes = {channel: channel.add_restore_commands(batch) for channel in channels}
+    if not any(changes.values()):
+        return
+
+    await batch.execute()
+    for channel, change in changes.items():
+        if change:
+            channel.async_apply(**change)
+
+
+async def _async_set_group(coordinator, channels, call: ServiceCall):
+    # All channels of an amp share the same sources and presets
+    source = channels[0].find_source(call.data[ATTR_SOURCE]) if ATTR_SOURCE in call.data else None
+    preset = channels[0].find_sound_mode(call.data[ATTR_PRESET]) if ATTR_PRESET in call.data else None
+    gain = coordinator.client.quantize_gain(call.data[ATTR_GAIN]) if ATTR_GAIN in call.data else None
+    muted = call.data.get(ATTR_MUTE)
+
+    results = await coordinator.client.set_group(
+        [channel.output_channel for channel in channels],
+        gain=gain,
+        muted=muted,
+        source=source.value + 1 if source is not None else None,
+        preset=preset.value if preset is not None else None
+    )
+
+    # The commands of every channel are in this order, only what the amp acknowledged is taken over
+    changes = [(name, value) for name, value in
+               (("gain", gain), ("muted", muted), ("source", source), ("sound_mode", preset)) if value is not None]
+    for index, channel in enumerate(channels):
+        replies = results[index * len(changes):(index + 1) * len(changes)]
+        applied = {name: value for (name, value), reply in zip(changes, replies) if reply is not None}
+        if applied:
+            channel.async_apply(**applied)
+
+
+def async_setup_services(hass: HomeAssistant):
+    if hass.services.has_service(DOMAIN, SERVICE_SET_GROUP):
+        return
+
+    async def async_set_group(call: ServiceCall):
+        await asyncio.gather(*(
+            _async_set_group(coordinator, channels, call)
+            for coordinator, channels in _channels_by_coordinator(hass, call.data[ATTR_ENTITY_ID])
+        ))
+
+    async def async_snapshot(call: ServiceCall):
+        await asyncio.gather(*(
+            _async_snapshot(hass, entry_id, channels)
+            for entry_id, _, channels in _amps(hass, call.data.get(ATTR_ENTITY_ID))
+        ))
+
+    async def async_restore(call: ServiceCall):
+        await asyncio.gather(*(
+            _async_restore(coordinator, channels)
+            for _, coordinator, channels in _amps(hass, call.data.get(ATTR_ENTITY_ID))
+        ))
+
+    hass.services.async_register(DOMAIN, SERVICE_SET_GROUP, async_set_group, schema=SET_GROUP_SCHEMA)
+    hass.services.async_register(DOMAIN, SERVICE_SNAPSHOT, async_snapshot, schema=SNAPSHOT_SCHEMA)
+    hass.services.async_register(DOMAIN, SERVICE_RESTORE, async_restore, schema=SNAPSHOT_SCHEMA)
+
+
+def async_unload_services(hass: HomeAssistant):
+    for service in (SERVICE_SET_GROUP, SERVICE_SNAPSHOT, SERVICE_RESTORE):
+        hass.services.async_remove(DOMAIN, service)
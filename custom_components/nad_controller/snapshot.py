@@ -0,0 +1,34 @@
+"""Snapshots of the output channels, to restore the whole amp after an announcement."""
+from dataclasses import asdict, dataclass
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from .config_flow import DOMAIN
+
+STORAGE_VERSION = 1
+
+
+@dataclass
+class ChannelSnapshot:
+    gain: float | None
+    muted: bool | None
+    source: str
+    preset: str
+
+
+class SnapshotStore:
+    """Keeps the snapshot of every output channel of an amp, by channel number."""
+
+    def __init__(self, hass: HomeAssistant, entry_id: str):
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}.snapshot")
+
+    async def async_load(self) -> dict[int, ChannelSnapshot]:
+        stored = await self._store.async_load() or {}
+        return {int(channel): ChannelSnapshot(**snapshot) for channel, snapshot in stored.items()}
+
+    async def async_save(self, snapshots: dict[int, ChannelSnapshot]):
+        await self._store.async_save({str(channel): asdict(snapshot) for channel, snapshot in snapshots.items()})
+
+    async def async_remove(self):
+        await self._store.async_remove()
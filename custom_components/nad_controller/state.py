@@ -0,0 +1,82 @@
+"""The state of all outputs of an amp, in fixed size arrays that its entities read from."""
+from array import array
+
+from .protocol import CHANNELS
+
+UNKNOWN = -1
+
+
+class NadState:
+    """Power, and per output the gain, mute, source and preset, indexed by zero based channel.
+
+    Gains are kept as the amp's steps of 0.5 dB from -6 dB, sources and presets as indices in
+    the input and preset lists of the topology. Values that are not known yet are UNKNOWN.
+    The accessors take one based channels, like the rest of the integration.
+    """
+    __slots__ = ("power", "gains", "mutes", "sources", "presets")
+
+    def __init__(self, power: bool = False):
+        self.power = power
+        self.gains = array("b", [UNKNOWN]) * CHANNELS
+        self.mutes = array("b", [UNKNOWN]) * CHANNELS
+        self.sources = array("b", [UNKNOWN]) * CHANNELS
+        self.presets = array("b", [UNKNOWN]) * CHANNELS
+
+    def _columns(self) -> tuple[array, ...]:
+        return self.gains, self.mutes, self.sources, self.presets
+
+    def copy(self) -> "NadState":
+        state = NadState(self.power)
+        state.gains, state.mutes, state.sources, state.presets = (column[:] for column in self._columns())
+        return state
+
+    def changed_channels(self, other: "NadState") -> list[int]:
+        """The channels of which any value differs from `other`.
+
+        Whole columns are compared first, only columns that differ are compared per channel.
+        """
+        changed = set()
+        for mine, theirs in zip(self._columns(), other._columns()):
+            if mine != theirs:
+                changed.update(index for index, (a, b) in enumerate(zip(mine, theirs)) if a != b)
+        return sorted(index + 1 for index in changed)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, NadState) and self.power == other.power and self._columns() == other._columns()
+
+    def as_dict(self) -> dict:
+        return {
+            "power": self.power,
+            "gains": [self.gain(channel) for channel in range(1, CHANNELS + 1)],
+            "mutes": [self.muted(channel) for channel in range(1, CHANNELS + 1)],
+            "sources": [self.source(channel) for channel in range(1, CHANNELS + 1)],
+            "presets": [self.preset(channel) for channel in range(1, CHANNELS + 1)],
+        }
+
+    def gain(self, channel: int) -> float | None:
+        step = self.gains[channel - 1]
+        return step / 2 - 6 if step != UNKNOWN else None
+
+    def set_gain(self, channel: int, gain: float):
+        self.gains[channel - 1] = int((min(6.0, max(-6.0, gain)) + 6) * 2)
+
+    def muted(self, channel: int) -> bool | None:
+        muted = self.mutes[channel - 1]
+        return bool(muted) if muted != UNKNOWN else None
+
+    def set_muted(self, channel: int, muted: bool):
+        self.mutes[channel - 1] = int(muted)
+
+    def source(self, channel: int) -> int | None:
+        source = self.sources[channel - 1]
+        return source if source != UNKNOWN else None
+
+    def set_source(self, channel: int, source: int):
+        self.sources[channel - 1] = source
+
+    def preset(self, channel: int) -> int | None:
+        preset = self.presets[channel - 1]
+        return preset if preset != UNKNOWN else None
+
+    def set_preset(self, channel: int, preset: int):
+        self.presets[channel - 1] = preset
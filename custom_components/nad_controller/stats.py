@@ -0,0 +1,86 @@
+"""Per opcode counters and latency histograms of the commands sent to an amp."""
+from bisect import bisect_left
+from dataclasses import dataclass, field
+
+# Upper bounds of the latency histogram buckets in seconds, the last bucket has no bound
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+@dataclass
+class OpcodeStats:
+    commands: int = 0
+    timeouts: int = 0
+    errors: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    latency_sum: float = 0.0
+    latency_buckets: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+
+    @property
+    def replies(self) -> int:
+        return sum(self.latency_buckets)
+
+    @property
+    def mean_latency(self) -> float | None:
+        return self.latency_sum / self.replies if self.replies else None
+
+    def observe(self, latency: float, reply_size: int):
+        self.latency_sum += latency
+        self.latency_buckets[bisect_left(LATENCY_BUCKETS, latency)] += 1
+        self.bytes_received += reply_size
+
+    def percentile(self, fraction: float) -> float | None:
+        """The upper bound of the bucket holding the given fraction of the replies."""
+        return _percentile(self.latency_buckets, fraction)
+
+    def as_dict(self) -> dict:
+        return {
+            "commands": self.commands,
+            "replies": self.replies,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "mean_latency": self.mean_latency,
+            "p95_latency": self.percentile(0.95),
+            "latency_buckets": dict(zip([*map(str, LATENCY_BUCKETS), "inf"], self.latency_buckets)),
+        }
+
+
+def _percentile(buckets: list[int], fraction: float) -> float | None:
+    total = sum(buckets)
+    if not total:
+        return None
+    seen = 0
+    for bound, count in zip([*LATENCY_BUCKETS, float("inf")], buckets):
+        seen += count
+        if seen >= fraction * total:
+            return bound
+    return float("inf")
+
+
+class CommandStats:
+    """The stats of every opcode that was sent, keyed by opcode."""
+
+    def __init__(self):
+        self.opcodes: dict[int, OpcodeStats] = {}
+
+    def __getitem__(self, opcode: int) -> OpcodeStats:
+        if opcode not in self.opcodes:
+            self.opcodes[opcode] = OpcodeStats()
+        return self.opcodes[opcode]
+
+    def total(self) -> OpcodeStats:
+        total = OpcodeStats()
+        for stats in self.opcodes.values():
+            total.commands += stats.commands
+            total.timeouts += stats.timeouts
+            total.errors += stats.errors
+            total.bytes_sent += stats.bytes_sent
+            total.bytes_received += stats.bytes_received
+            total.latency_sum += stats.latency_sum
+            total.latency_buckets = [a + b for a, b in zip(total.latency_buckets, stats.latency_buckets)]
+        return total
+
+    def as_dict(self) -> dict:
+        return {f"0x{opcode:02X}": stats.as_dict() for opcode, stats in sorted(self.opcodes.items())}
@@ -0,0 +1,86 @@
+"""The in-out topology of a NAD multi-room audio controller, as read from its web interface."""
+from dataclasses import dataclass, field
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from .config_flow import DOMAIN
+
+STORAGE_VERSION = 1
+
+
+@dataclass
+class InputChannel:
+    name: str
+    gain: float
+    value: int
+
+
+@dataclass
+class Preset:
+    name: str
+    value: int
+
+
+@dataclass
+class OutputChannel:
+    name: str
+    gain: float
+    value: int
+    source: InputChannel
+    dsp_preset: Preset
+
+
+@dataclass
+class Topology:
+    inputs: list[InputChannel]
+    presets: list[Preset]
+    outputs: list[OutputChannel]
+    # Shared by all channels of the amp, to look up what the user picked by name
+    source_list: list[str] = field(init=False, compare=False)
+    sound_mode_list: list[str] = field(init=False, compare=False)
+    source_index: dict[str, int] = field(init=False, compare=False)
+    sound_mode_index: dict[str, int] = field(init=False, compare=False)
+
+    def __post_init__(self):
+        self.source_list = [source.name for source in self.inputs]
+        self.sound_mode_list = [preset.name for preset in self.presets]
+        # Reversed, so the first of equally named ones wins
+        self.source_index = {name: index for index, name in reversed(list(enumerate(self.source_list)))}
+        self.sound_mode_index = {name: index for index, name in reversed(list(enumerate(self.sound_mode_list)))}
+
+
+def parse_in_out(in_outs: dict) -> Topology:
+    inputs = [InputChannel(
+        in_outs['input-names'][i]['name'],
+        float(in_outs['input-gain'][i]),
+        int(in_outs['input-names'][i]['value'])
+    ) for i in range(len(in_outs['input-names']))]
+
+    presets = [Preset(dsp_item['name'], int(dsp_item['value'])) for dsp_item in in_outs['dsp-preset-items']]
+
+    outputs = [OutputChannel(
+        in_outs['output-names'][i]['name'],
+        float(in_outs['output-gain'][i]),
+        int(in_outs['output-names'][i]['value']),
+        inputs[in_outs['sources'][i]],
+        presets[in_outs['dsp-presets'][i]]
+    ) for i in range(len(in_outs['output-names']))]
+
+    return Topology(inputs, presets, outputs)
+
+
+class TopologyStore:
+    """Keeps the last read in-out payload, so entities can be built without the web interface."""
+
+    def __init__(self, hass: HomeAssistant, entry_id: str):
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}.topology")
+
+    async def async_load(self) -> dict | None:
+        return await self._store.async_load()
+
+    async def async_save(self, in_outs: dict):
+        await self._store.async_save(in_outs)
+
+    async def async_remove(self):
+        await self._store.async_remove()
@@ -0,0 +1,284 @@
+"""Benchmarks the NAD clients against the simulator.
+
+Every scenario runs full refreshes, the power status and the gain and mute of all 16 outputs,
+and reports refresh times, commands per second and tail latencies. The in-out scenario refreshes
+like the coordinator does: the gains from the in-out page of the web interface, together with
+the power status and mutes over TCP.
+
+    python tools/benchmark.py --latency 0.002 --fragment 7 --save baseline.json
+    python tools/benchmark.py --latency 0.002 --fragment 7 --compare baseline.json
+
+With --compare it exits with status 1 when a scenario got slower than the tolerance allows.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import socket
+import statistics
+import sys
+import time
+import types
+from functools import partial
+from pathlib import Path
+
+from nad_simulator import LinkOptions, SimulatorServer
+
+INTEGRATION_PATH = Path(__file__).resolve().parent.parent / "custom_components" / "nad_controller"
+OUTPUT_CHANNELS = range(1, 17)
+
+
+def _load_client():
+    """Import the clients without the Home Assistant parts of the integration."""
+    package = types.ModuleType("nad_controller")
+    package.__path__ = [str(INTEGRATION_PATH)]
+    sys.modules["nad_controller"] = package
+    return importlib.import_module("nad_controller.nad_client")
+
+
+nad_client = _load_client()
+protocol = importlib.import_module("nad_controller.protocol")
+
+
+class SyncNadClient(nad_client.NadCommands):
+    """A blocking client on the command table, to compare the asyncio client with."""
+
+    def __init__(self, ip: str, port: int):
+        self._ip = ip
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.connect((ip, port))
+        self._framer = protocol.NadFramer()
+        self._frames = []
+
+    def send(self, frame: bytes, reply=None):
+        self._socket.send(frame)
+        while True:
+            while self._frames:
+                frame = self._frames.pop(0)
+                if protocol.reply_matches(frame, reply):
+                    return frame
+
+            data = self._socket.recv(nad_client.BUFFER_SIZE)
+            if not data:
+                return None
+            self._frames.extend(self._framer.feed(data))
+
+    def _command(self, frame: bytes, reply=None, parse=None, cache_key=None, writes=None):
+        return self._parse_response(self.send(frame, reply), reply, parse)
+
+    def close(self):
+        self._socket.close()
+
+
+def _refresh_commands(client):
+    """Queue the commands of a full refresh on a client or a batch, returns how many there are."""
+    results = [client.get_power_status()]
+    for channel in OUTPUT_CHANNELS:
+        results.append(client.get_output_gain(channel))
+        results.append(client.get_output_mute(channel))
+    return results
+
+
+async def _sync_sequential(server: SimulatorServer, refreshes: int) -> tuple[list[float], list[float]]:
+    """A blocking client, one command at a time."""
+
+    def run():
+        client = SyncNadClient("127.0.0.1", server.port)
+        commands = [client.get_power_status] + [
+            partial(get, channel)
+            for channel in OUTPUT_CHANNELS for get in (client.get_output_gain, client.get_output_mute)
+        ]
+        refresh_times, command_times = [], []
+        for _ in range(refreshes):
+            start = time.perf_counter()
+            for command in commands:
+                sent = time.perf_counter()
+                command()
+                command_times.append(time.perf_counter() - sent)
+            refresh_times.append(time.perf_counter() - start)
+        client.close()
+        return refresh_times, command_times
+
+    return await asyncio.to_thread(run)
+
+
+async def _async_sequential(server: SimulatorServer, refreshes: int) -> tuple[list[float], list[float]]:
+    """The asyncio client, awaiting every command before sending the next."""
+    client = nad_client.AsyncNadClient("127.0.0.1", server.port, cache_ttl=0)
+    await client.connect()
+    refresh_times, command_times = [], []
+    try:
+        for _ in range(refreshes):
+            start = time.perf_counter()
+            for awaitable in _refresh_commands(client):
+                sent = time.perf_counter()
+                await awaitable
+                command_times.append(time.perf_counter() - sent)
+            refresh_times.append(time.perf_counter() - start)
+    finally:
+        await client.close()
+    return refresh_times, command_times
+
+
+async def _async_batch(server: SimulatorServer, refreshes: int) -> tuple[list[float], list[float]]:
+    """The asyncio client, pipelining all commands of a refresh in one write, like the coordinator."""
+    client = nad_client.AsyncNadClient("127.0.0.1", server.port, cache_ttl=0)
+    await client.connect()
+    refresh_times = []
+    try:
+        for _ in range(refreshes):
+            start = time.perf_counter()
+            batch = client.batch()
+            _refresh_commands(batch)
+            await batch.execute()
+            refresh_times.append(time.perf_counter() - start)
+    finally:
+        await client.close()
+    # Pipelined commands have no latency of their own, all of them wait for the whole refresh
+    return refresh_times, []
+
+
+async def _async_in_out(server: SimulatorServer, refreshes: int) -> tuple[list[float], list[float]]:
+    """The asyncio client, reading the in-out page while the power status and mutes are read over TCP."""
+    client = nad_client.AsyncNadClient("127.0.0.1", server.port, cache_ttl=0,
+                                       web_url=f"http://127.0.0.1:{server.http_port}")
+    await client.connect()
+    refresh_times = []
+    try:
+        for _ in range(refreshes):
+            start = time.perf_counter()
+            batch = client.batch()
+            batch.get_power_status()
+            for channel in OUTPUT_CHANNELS:
+                batch.get_output_mute(channel)
+            await asyncio.gather(batch.execute(), client.read_in_out())
+            refresh_times.append(time.perf_counter() - start)
+    finally:
+        await client.close()
+    return refresh_times, []
+
+
+async def _async_user_during_refresh(server: SimulatorServer, refreshes: int) -> tuple[list[float], list[float]]:
+    """The asyncio client running refreshes, with a mute sent once every refresh is on its way.
+
+    The command times are those of the mutes, the latency a user sees while the amp is polled.
+    """
+    client = nad_client.AsyncNadClient("127.0.0.1", server.port, cache_ttl=0)
+    await client.connect()
+    refresh_times, command_times = [], []
+    try:
+        for index in range(refreshes):
+            start = time.perf_counter()
+            batch = client.batch()
+            _refresh_commands(batch)
+            refresh = asyncio.ensure_future(batch.execute())
+            # Let the send loop write the first commands of the refresh
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            sent = time.perf_counter()
+            await client.set_output_mute(1, index % 2 == 0)
+            command_times.append(time.perf_counter() - sent)
+            await refresh
+            refresh_times.append(time.perf_counter() - start)
+    finally:
+        await client.close()
+    return refresh_times, command_times
+
+
+SCENARIOS = {
+    "sync_sequential": _sync_sequential,
+    "async_sequential": _async_sequential,
+    "async_batch": _async_batch,
+    "async_in_out": _async_in_out,
+    "async_user_during_refresh": _async_user_during_refresh,
+}
+
+
+def _percentile(values: list[float], fraction: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def _milliseconds(seconds: float | None) -> float | None:
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+async def run(options: LinkOptions, refreshes: int, scenarios: list[str]) -> dict[str, dict]:
+    server = SimulatorServer(options=options)
+    await server.start(http_port=0)
+    results = {}
+    try:
+        for name in scenarios:
+            commands_before = server.amp.commands
+            start = time.perf_counter()
+            refresh_times, command_times = await SCENARIOS[name](server, refreshes)
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                "refresh_mean_ms": _milliseconds(statistics.mean(refresh_times)),
+                "refresh_p50_ms": _milliseconds(_percentile(refresh_times, 0.5)),
+                "refresh_p95_ms": _milliseconds(_percentile(refresh_times, 0.95)),
+                "refresh_p99_ms": _milliseconds(_percentile(refresh_times, 0.99)),
+                "command_p99_ms": _milliseconds(_percentile(command_times, 0.99)),
+                "commands_per_second": round((server.amp.commands - commands_before) / elapsed, 1),
+            }
+    finally:
+        await server.stop()
+    return results
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], tolerance: float) -> list[str]:
+    """Describe every scenario that got slower than the baseline by more than the tolerance."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["commands_per_second"] < base["commands_per_second"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['commands_per_second']} commands/s, "
+                               f"was {base['commands_per_second']}")
+        if result["refresh_p95_ms"] > base["refresh_p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: refresh p95 {result['refresh_p95_ms']} ms, was {base['refresh_p95_ms']}")
+    return regressions
+
+
+def _print_table(results: dict[str, dict]):
+    columns = ["refresh_mean_ms", "refresh_p50_ms", "refresh_p95_ms", "refresh_p99_ms", "command_p99_ms",
+               "commands_per_second"]
+    print(f"{'scenario':<26}" + "".join(f"{column:>21}" for column in columns))
+    for name, result in results.items():
+        print(f"{name:<26}" + "".join(f"{str(result[column]):>21}" for column in columns))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--refreshes", type=int, default=50)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Run only these scenarios")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the simulator takes per command")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra seconds per command")
+    parser.add_argument("--fragment", type=int, default=0, help="Write replies in chunks of this many bytes")
+    parser.add_argument("--coalesce", type=float, default=0.0, help="Hold replies back this many seconds")
+    parser.add_argument("--save", type=Path, help="Write the results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="Compare the results to those saved in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown, as a fraction")
+    args = parser.parse_args()
+
+    options = LinkOptions(args.latency, args.jitter, args.fragment, args.coalesce)
+    results = asyncio.run(run(options, args.refreshes, args.scenario or list(SCENARIOS)))
+    _print_table(results)
+
+    if args.save is not None:
+        args.save.write_text(json.dumps(results, indent=2))
+
+    if args.compare is not None:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"Regression in {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
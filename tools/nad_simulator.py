@@ -0,0 +1,292 @@
+"""Emulates a NAD CI 16-60 on the local machine, for benchmarks and for trying out the integration.
+
+The TCP server answers every command the integration sends, with replies in the formats of the amp.
+An optional web server serves the in-out page of /Web/Handler.php.
+
+    python tools/nad_simulator.py --port 52000 --http-port 8080 --latency 0.005 --fragment 7
+"""
+import argparse
+import asyncio
+import logging
+import random
+from dataclasses import dataclass
+
+from aiohttp import web
+
+_LOGGER = logging.getLogger(__name__)
+
+CHANNELS = 16
+PRESETS = 10
+POWER_METHODS = ["Power Button", "Always On", "12V Trigger", "Signal Sense"]
+
+
+@dataclass
+class LinkOptions:
+    # Seconds the amp takes for every command, the amp handles them one by one
+    latency: float = 0.0
+    # Random extra seconds, up to this much, on top of the latency
+    jitter: float = 0.0
+    # Replies are written in chunks of at most this many bytes, 0 writes them whole
+    fragment: int = 0
+    # Replies are held back for this many seconds and written together, 0 writes them right away
+    coalesce: float = 0.0
+
+
+class SimulatedAmp:
+    """The state of the amp and the replies it gives to command frames."""
+
+    def __init__(self, name="Simulated amp"):
+        self.name = name
+        self.model = "CI 16-60"
+        self.firmware = "1.0.0"
+        self.serial_number = "SIM0000000001"
+        self.power = True
+        self.power_method = 0
+        self.green = False
+        self.delay_time = 0
+        self.input_gains = [0.0] * CHANNELS
+        self.output_gains = [0.0] * CHANNELS
+        self.mutes = [False] * CHANNELS
+        self.sources = list(range(CHANNELS))
+        self.presets = [0] * CHANNELS
+        self.stereo = [True] * CHANNELS
+        self.bridged = [False] * CHANNELS
+        self.global_inputs = [False, False]
+        self.input_names = [f"Input {i + 1}" for i in range(CHANNELS)]
+        self.output_names = [f"Output {i + 1}" for i in range(CHANNELS)]
+        self.preset_names = [f"Preset {i + 1}" for i in range(PRESETS)]
+        self.commands = 0
+
+    def reply(self, frame: bytes) -> str:
+        self.commands += 1
+        opcode, args = frame[3], frame[4:]
+        handler = self._handlers().get(opcode)
+        if handler is None:
+            return "Unknown command"
+        return handler(*args)
+
+    def _handlers(self):
+        return {
+            0xE0: lambda: self.name,
+            0xE1: lambda: self.model,
+            0xE2: lambda: "Simulation",
+            0xE4: lambda: "2024-01-01",
+            0xE5: lambda: self.firmware,
+            0xE6: lambda: self.serial_number,
+            0xEB: lambda on: f"Flash LED:{'ON' if on else 'OFF'}",
+            0xEC: lambda dhcp: f"IP Method:{'DHCP' if dhcp else 'STATIC'}",
+            0xED: lambda *ip: ".".join(map(str, ip)),
+            0xEE: lambda *mask: ".".join(map(str, mask)),
+            0xF0: self._set_global,
+            0xF1: self._set_input_gain,
+            0xF2: self._set_output_gain,
+            0xF3: self._set_preset,
+            0xF4: self._set_source,
+            0xF5: self._set_stereo_mono,
+            0xF6: self._set_bridge,
+            0xF7: self._set_mute,
+            0x10: lambda c: f"Channel[{c}] Output Gain:{self.output_gains[c]:g}",
+            0x12: lambda c: f"Channel[{c}] Mute Status:{'Mute' if self.mutes[c] else 'Unmute'}",
+            0xF8: self._set_power_method,
+            0xF9: self._set_green_mode,
+            0xFA: self._set_delay_time,
+            0xFB: lambda: "Wait system reset all",
+            0x01: lambda: self._set_power(True, "Cmd:PowerOn"),
+            0x02: lambda: self._set_power(False, "Cmd:PowerOff"),
+            0x03: lambda: self._set_power(not self.power, "Cmd:PowerToggle"),
+            0x70: lambda: f"Power status:{'On' if self.power else 'Off'}",
+        }
+
+    def _set_global(self, index, on):
+        self.global_inputs[index] = bool(on)
+        return f"Set Global {index + 1} {'ON' if on else 'OFF'}"
+
+    def _set_input_gain(self, channel, step):
+        self.input_gains[channel] = step / 2 - 6
+        return f"Cmd:ChannelInputGain ,Channel Input {channel + 1}"
+
+    def _set_output_gain(self, channel, step):
+        self.output_gains[channel] = step / 2 - 6
+        return f"Cmd:ChannelOutputGain ,Channel Output {channel + 1}"
+
+    def _set_preset(self, channel, preset):
+        self.presets[channel] = preset
+        return f"Cmd:ChannelOutputPreset ,Channel Output {channel + 1}"
+
+    def _set_source(self, channel, source):
+        self.sources[channel] = source
+        return f"Cmd:ChannelOutputSource ,Channel Output {channel + 1}"
+
+    def _set_stereo_mono(self, channel, stereo):
+        self.stereo[channel] = stereo == 0
+        return f"Cmd:ChannelStereoMono ,Channel Input {channel + 1}"
+
+    def _set_bridge(self, channel, bridged):
+        self.bridged[channel] = bridged == 1
+        return f"Cmd:ChannelBridge ,Channel Output {channel + 1}"
+
+    def _set_mute(self, channel, unmute):
+        self.mutes[channel] = unmute == 0
+        return f"Cmd:ChannelMute ,Channel Output {channel + 1}"
+
+    def _set_power_method(self, method):
+        self.power_method = method
+        return f"Power mode:{POWER_METHODS[method]}"
+
+    def _set_green_mode(self, green):
+        self.green = bool(green)
+        return f"Green mode:{'on' if green else 'off'}"
+
+    def _set_delay_time(self, step):
+        self.delay_time = step * 2
+        return f"AutoOnDelayTime:{self.delay_time}"
+
+    def _set_power(self, power, reply):
+        self.power = power
+        return reply
+
+    def in_out(self) -> dict:
+        """The in-out page of Handler.php."""
+        return {
+            "input-names": [{"name": name, "value": i} for i, name in enumerate(self.input_names)],
+            "input-gain": [str(gain) for gain in self.input_gains],
+            "output-names": [{"name": name, "value": i} for i, name in enumerate(self.output_names)],
+            "output-gain": [str(gain) for gain in self.output_gains],
+            "sources": list(self.sources),
+            "dsp-preset-items": [{"name": name, "value": i} for i, name in enumerate(self.preset_names)],
+            "dsp-presets": list(self.presets),
+        }
+
+
+class SimulatorServer:
+    """Serves a simulated amp over TCP, and optionally its web interface over HTTP."""
+
+    def __init__(self, amp: SimulatedAmp | None = None, options: LinkOptions | None = None):
+        self.amp = amp or SimulatedAmp()
+        self.options = options or LinkOptions()
+        self.port = None
+        self.http_port = None
+        self._server = None
+        self._http_runner = None
+        self._writers: set[asyncio.StreamWriter] = set()
+        self._connections: set[asyncio.Task] = set()
+
+    async def start(self, host="127.0.0.1", port=0, http_port: int | None = None):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+        if http_port is not None:
+            app = web.Application()
+            app.router.add_get("/Web/Handler.php", self._handle_http)
+            self._http_runner = web.AppRunner(app)
+            await self._http_runner.setup()
+            site = web.TCPSite(self._http_runner, host, http_port)
+            await site.start()
+            self.http_port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        connections = list(self._connections)
+        for writer in list(self._writers):
+            writer.close()
+        # A connection may be waiting out the latency of a command
+        for connection in connections:
+            connection.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._http_runner is not None:
+            await self._http_runner.cleanup()
+
+    async def push(self, reply: str):
+        """Send an unsolicited status line to every connected client, like a change on the front panel."""
+        for writer in list(self._writers):
+            await self._write(writer, reply.encode() + b"\0")
+
+    async def _handle_http(self, request: web.Request) -> web.Response:
+        if request.query.get("page") != "in-out":
+            return web.json_response({}, status=404)
+        # The real amp does not send a JSON content type either
+        return web.json_response(self.amp.in_out(), content_type="text/html")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        self._connections.add(asyncio.current_task())
+        pending = bytearray()
+        flush = None
+        buffer = b""
+        try:
+            while data := await reader.read(1024):
+                buffer += data
+                # FF 55, the length of what follows, then the opcode and its arguments
+                while len(buffer) >= 3:
+                    if buffer[:2] != b"\xff\x55":
+                        _LOGGER.warning(f"Skipping byte {buffer[0]:02X}, no frame starts there")
+                        buffer = buffer[1:]
+                        continue
+                    length = 3 + buffer[2]
+                    if len(buffer) < length:
+                        break
+                    frame, buffer = buffer[:length], buffer[length:]
+
+                    delay = self.options.latency + random.uniform(0, self.options.jitter)
+                    if delay:
+                        await asyncio.sleep(delay)
+                    reply = self.amp.reply(frame).encode() + b"\0"
+
+                    if not self.options.coalesce:
+                        await self._write(writer, reply)
+                        continue
+                    pending += reply
+                    if flush is None or flush.done():
+                        flush = asyncio.create_task(self._flush_later(writer, pending))
+        except (ConnectionError, asyncio.CancelledError):
+            # Cancelled by stop(), which ends the connection anyway
+            pass
+        finally:
+            self._writers.discard(writer)
+            self._connections.discard(asyncio.current_task())
+            writer.close()
+
+    async def _flush_later(self, writer: asyncio.StreamWriter, pending: bytearray):
+        await asyncio.sleep(self.options.coalesce)
+        while pending:
+            data = bytes(pending)
+            pending.clear()
+            await self._write(writer, data)
+
+    async def _write(self, writer: asyncio.StreamWriter, data: bytes):
+        size = self.options.fragment or len(data)
+        for start in range(0, len(data), size):
+            writer.write(data[start:start + size])
+            await writer.drain()
+            if start + size < len(data):
+                # Give the client a chance to read the fragment on its own
+                await asyncio.sleep(0)
+
+
+async def _main(args):
+    server = SimulatorServer(options=LinkOptions(args.latency, args.jitter, args.fragment, args.coalesce))
+    await server.start(args.host, args.port, args.http_port)
+    _LOGGER.info(f"Simulating a NAD CI 16-60 on {args.host}:{server.port}"
+                 + (f", web interface on port {server.http_port}" if server.http_port else ""))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=52000)
+    parser.add_argument("--http-port", type=int, help="Serve /Web/Handler.php on this port")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per command")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra seconds per command")
+    parser.add_argument("--fragment", type=int, default=0, help="Write replies in chunks of this many bytes")
+    parser.add_argument("--coalesce", type=float, default=0.0, help="Hold replies back this many seconds")
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass